@@ -0,0 +1,142 @@
+// Wire formats of the messages exchanged with the SG entities (see entities/sg_wire.py)
+//  - JSON: the message as a JSON string (default, and fallback of every connection)
+//  - SGB1: "SGB1" | header length (uint32 LE) | header JSON, padded with spaces to a multiple of 8 bytes | body
+//    The body holds the float64 LE arrays of the message. In the header, an array is replaced by
+//    {"__f64": [offset, n]} (offset in number of floats in the body) and regular timestamps by {"__ts": [t_0, dt, n]}.
+
+var os = require('os');
+
+var WIRE_FORMAT_JSON = "JSON";
+var WIRE_FORMAT_BINARY = "SGB1";
+var ARRAY_KEY = "forecast_data";  // the arrays of numbers under this key are sent as float64 arrays
+var LITTLE_ENDIAN = os.endianness() == "LE";
+
+// Regular timestamps t_0, t_0 + dt, ... (n values), as decoded from a binary message
+class TimeRange {
+  constructor(t_0, dt, n) {
+    this.t_0 = t_0;
+    this.dt = dt;
+    this.n = n;
+  }
+
+  toArray() {
+    var values = new Array(this.n);
+    for (var k = 0; k < this.n; k++) {
+      values[k] = this.t_0 + k * this.dt;
+    }
+    return values;
+  }
+
+  toJSON() {
+    return this.toArray();
+  }
+
+  toString() {
+    return this.toArray().toString();
+  }
+}
+
+var isNumberArray = function(obj) {
+  return Array.isArray(obj) && obj.every(function(v) { return typeof v === "number"; });
+};
+
+// JSON encoding, with the typed arrays written as plain arrays
+var toJSON = function(msg) {
+  return JSON.stringify(msg, function(key, value) {
+    return ArrayBuffer.isView(value) ? Array.from(value) : value;
+  });
+};
+
+var encode = function(msg, wire_format=WIRE_FORMAT_BINARY) {
+  if (wire_format != WIRE_FORMAT_BINARY) {
+    return toJSON(msg);
+  }
+
+  var arrays = [];
+  var size = 0;  // number of floats in the body
+
+  var pack = function(obj, key=null) {
+    if (obj instanceof TimeRange) {
+      return {"__ts": [obj.t_0, obj.dt, obj.n]};
+    }
+    if (ArrayBuffer.isView(obj) || (key == ARRAY_KEY && isNumberArray(obj))) {
+      var array = Float64Array.from(obj);
+      arrays.push(array);
+      size += array.length;
+      return {"__f64": [size - array.length, array.length]};
+    }
+    if (Array.isArray(obj)) {
+      return obj.map(function(v) { return pack(v); });
+    }
+    if (obj !== null && typeof obj === "object") {
+      var packed = {};
+      Object.keys(obj).forEach(function(k) {
+        packed[k] = pack(obj[k], k);
+      });
+      return packed;
+    }
+    return obj;
+  };
+
+  var header = Buffer.from(JSON.stringify(pack(msg)), "utf8");
+  var padding = (8 - (WIRE_FORMAT_BINARY.length + 4 + header.length) % 8) % 8;
+
+  var prefix = Buffer.alloc(WIRE_FORMAT_BINARY.length + 4);
+  prefix.write(WIRE_FORMAT_BINARY, 0, "latin1");
+  prefix.writeUInt32LE(header.length + padding, WIRE_FORMAT_BINARY.length);
+
+  var body = Buffer.alloc(8 * size);
+  var offset = 0;
+  arrays.forEach(function(array) {
+    if (LITTLE_ENDIAN) {
+      Buffer.from(array.buffer, array.byteOffset, array.byteLength).copy(body, offset);
+    } else {
+      array.forEach(function(v, k) { body.writeDoubleLE(v, offset + 8 * k); });
+    }
+    offset += array.byteLength;
+  });
+
+  return Buffer.concat([prefix, header, Buffer.alloc(padding, " "), body]);
+};
+
+// Decode a message in any wire format. The float64 arrays are views of the received buffer when it is aligned.
+var decode = function(raw) {
+  var buf = Buffer.isBuffer(raw) ? raw : Buffer.from(raw);
+
+  if (buf.length < WIRE_FORMAT_BINARY.length + 4 || buf.toString("latin1", 0, WIRE_FORMAT_BINARY.length) != WIRE_FORMAT_BINARY) {
+    return JSON.parse(buf.toString("utf8"));
+  }
+
+  var header_length = buf.readUInt32LE(WIRE_FORMAT_BINARY.length);
+  var body_start = WIRE_FORMAT_BINARY.length + 4 + header_length;
+
+  return JSON.parse(buf.toString("utf8", WIRE_FORMAT_BINARY.length + 4, body_start), function(key, value) {
+    if (value !== null && typeof value === "object" && Object.keys(value).length == 1) {
+      if (value.__f64 !== undefined) {
+        var start = body_start + 8 * value.__f64[0];
+        var n = value.__f64[1];
+        if (LITTLE_ENDIAN && (buf.byteOffset + start) % 8 == 0) {
+          return new Float64Array(buf.buffer, buf.byteOffset + start, n);
+        }
+        var array = new Float64Array(n);
+        for (var k = 0; k < n; k++) {
+          array[k] = buf.readDoubleLE(start + 8 * k);
+        }
+        return array;
+      }
+      if (value.__ts !== undefined) {
+        return new TimeRange(value.__ts[0], value.__ts[1], value.__ts[2]);
+      }
+    }
+    return value;
+  });
+};
+
+module.exports = {
+  WIRE_FORMAT_JSON: WIRE_FORMAT_JSON,
+  WIRE_FORMAT_BINARY: WIRE_FORMAT_BINARY,
+  TimeRange: TimeRange,
+  encode: encode,
+  decode: decode,
+  toJSON: toJSON
+};
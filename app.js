@@ -18,6 +18,9 @@ var AUTOMATED_SIMULATION = CONFIG_OBJ.SG_SIMULATION_CONFIG.AUTOMATED_SIMULATION;
 
 var TOTAL_SB_NODES = CONFIG_OBJ.SB_CONFIG.NB;  // Total Smart Buildings
 var current_planning_iteration = 0;
+
+// SEQUENTIAL: the SBs solve one after the other; JACOBI: all the SBs solve against the same snapshot at each round
+var PLANNING_UPDATE_MODE = CONFIG_OBJ.SIMULATION_PARAMETERS.PLANNING_UPDATE_MODE || "SEQUENTIAL";
 // for (var sb_unit_key in CONFIG_OBJ.SB_CONFIG.NB) {
 //   TOTAL_SB_NODES += CONFIG_OBJ.INSTANCES.SB[sb_unit_key].NB;
 // }
@@ -42,6 +45,12 @@ console.log(' - '+TOTAL_SB_NODES+' simulated Smart-Buildings');
 var BROADCAST_ID = CONFIG_OBJ.ZMQ_CONFIG.BROADCAST_ID; // The receiver ID for broadcast purpose
 var ZMQ_NODEJS_PUB = CONFIG_OBJ.ZMQ_CONFIG.SG_COORD_PUB; // Node JS sends to this port
 var ZMQ_ENTITY_PUB = CONFIG_OBJ.ZMQ_CONFIG.SG_ENTITY_PUB; // GRID_MANAGER, DER and SB publish to this port
+var WIRE_FORMAT = CONFIG_OBJ.ZMQ_CONFIG.WIRE_FORMAT || "JSON"; // JSON, or SGB1 to accept the binary format
+var FAST_FORWARD = CONFIG_OBJ.SIMULATION_PARAMETERS.FAST_FORWARD || false; // the entities do not wait: explicit registration handshake
+
+// Random draws of the coordinator (order of the round-robin planning): reproducible when a SEED is given
+var SIMULATION_SEED = CONFIG_OBJ.SIMULATION_PARAMETERS.SEED;
+var coordinator_rng = (SIMULATION_SEED == null) ? Math.random : seeded_rng(SIMULATION_SEED);
 
 var current_time = -CONFIG_OBJ.SIMULATION_PARAMETERS.TIME_STEP;  // Starting the time just before the simulation beginning
 
@@ -111,6 +120,7 @@ io.sockets.on('connection', function (socket) {
 // -------------------------------------- ///
 
 var zmq = require('zeromq');
+var sg_wire = require('./app-nodejs/sg_wire');
 var publisher = zmq.socket('pub');
 var subscriber = zmq.socket('sub');
 
@@ -184,6 +194,7 @@ var mgm_pp_ready = [];
 var pp_phase_data = null;
 
 var mgm_rt_data = null; // Data to be passed from the MGM to the SBs (price of elec)
+var wire_binary = {}; // the IDs of the entities that negotiated the binary wire format
 var explicit_planningphase_req = false; // true is a SB requests a Planning phase
 
 // ---------
@@ -201,8 +212,28 @@ simulation_backend_interface.on(PARAM_OBJ.SG_COORD_SIGNAL.NEW_CONNECTION, functi
 
   console.log("New connection from " + id);
 
-  // Add this building in the list
-  update_connected_actor(id)
+  // Negotiate the wire format, if the entity offers some
+  var json_obj = sg_wire.decode(msg);
+  var offered_formats = (json_obj.data != null) ? json_obj.data[PARAM_OBJ.NEW_CONNECTION_PAYLOAD_KEYS.WIRE_FORMATS] : undefined;
+  if (offered_formats !== undefined) {
+    var wire_format = sg_wire.WIRE_FORMAT_JSON;
+    if (WIRE_FORMAT == sg_wire.WIRE_FORMAT_BINARY && offered_formats.indexOf(sg_wire.WIRE_FORMAT_BINARY) >= 0) {
+      wire_format = sg_wire.WIRE_FORMAT_BINARY;
+      wire_binary[id] = true;
+    }
+    send_connection_ack(id, wire_format);
+
+    // FAST FORWARD: the entity is connected once it confirms that it has received the acknowledgement (a NEW_CONNECTION
+    // with the chosen WIRE_FORMAT), i.e. once it is sure to receive the next messages
+    if (FAST_FORWARD) {
+      return;
+    }
+  }
+
+  // Add this building in the list, only once: an entity registers again until its registration is acknowledged
+  if (!update_connected_actor(id)) {
+    return;
+  }
 
   // Send to the UI that a new actor is ready
   ui_send_simu_info();
@@ -222,9 +253,19 @@ simulation_backend_interface.on(PARAM_OBJ.SG_COORD_SIGNAL.NEW_CONNECTION, functi
 
 // New RT data from an actor
 simulation_backend_interface.on(PARAM_OBJ.SG_COORD_SIGNAL.SIMU_STEP, function(id, msg) {
+  receive_rt_data(id, sg_wire.decode(msg));
+});
+
+// New RT data from several actors of a host process, in one message: each entry is handled as a separate message
+simulation_backend_interface.on(PARAM_OBJ.SG_COORD_SIGNAL.SIMU_STEP_BATCH, function(id, msg) {
+  var json_obj = sg_wire.decode(msg);
+  json_obj.data[PARAM_OBJ.NEXT_SIMU_STEP_PAYLOAD_KEYS.BATCH_ENTRIES].forEach(function(entry) {
+    receive_rt_data(entry.id, entry);
+  });
+});
 
-  // Decode the message
-  json_obj = JSON.parse(msg);
+// RT data of an actor: {"data": RT payload, "timestamp": t}
+function receive_rt_data(id, json_obj) {
   type_actor = getDataTypeFromID(id);
 
   // Update the current time
@@ -275,12 +316,20 @@ simulation_backend_interface.on(PARAM_OBJ.SG_COORD_SIGNAL.SIMU_STEP, function(id
       broadcast_start_step_signal();
     }
   }
-});
+}
 
 // ------------------ New PLANNING data from an entity
 simulation_backend_interface.on(PARAM_OBJ.SG_COORD_SIGNAL.PLANNING_SIGNAL, function(id, msg) {
 
-  json_obj = JSON.parse(msg);
+  json_obj = sg_wire.decode(msg);
+
+  // Decentralized: the SBs send the runs of their forecast that changed, rebuild the whole forecast
+  if (!CENTRALIZED_ARCHITECTURE && getDataTypeFromID(id) == "sb") {
+    receive_forecast_resync_request(id, json_obj.data[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.RESYNC]);
+    if (json_obj.data[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST] !== undefined) {
+      json_obj.data[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST] = receive_forecast_update(id, json_obj.data[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST]);
+    }
+  }
 
   // Notify the UI
   ui_send_forecast_data(id, json_obj.data, json_obj.timestamp);
@@ -394,16 +443,26 @@ function planning_decentralized_logic(id, json_obj) {
         // All the SB have answered to the initial START sig ?
         if (sb_pp_ready.length >= TOTAL_SB_NODES) {
           sb_pp_ready = [];
-          pp_phase_current_sb_idx = 0;
 
-          send_decentralized_gt_planning_data(sb_connected[pp_phase_current_sb_idx], pp_phase_data["sb"]);
+          if (PLANNING_UPDATE_MODE == "JACOBI") {
+            pp_phase_round_data = {};
+            broadcast_planning_data_signal(CONFIG_OBJ.ZMQ_CONFIG.GROUP_SB_ID, jacobi_snapshot());
+          } else {
+            pp_phase_current_sb_idx = 0;
+            send_decentralized_gt_planning_data(sb_connected[pp_phase_current_sb_idx], pp_phase_data["sb"]);
+          }
         }
       }
 
       break;
     case PARAM_OBJ.PLANNING_SIGNAL_TYPE_SIGNAL.DATA_TYPE: // DATA: during the PP phase
     // Only SB here
-      console.log('Iter #'+current_planning_iteration+' - Received a Round message from SB#'+id);
+      if (PLANNING_UPDATE_MODE == "JACOBI") {
+        planning_jacobi_logic(id, json_obj);
+        break;
+      }
+
+      console.log('Iter #'+current_planning_iteration+' - Received a Round message from SB#'+id+residual_info(json_obj));
 
       // Update received data from SB
 
@@ -449,6 +508,151 @@ function planning_decentralized_logic(id, json_obj) {
   }
 }
 
+// ------------------ DECENTRALIZED LOGIC, JACOBI ROUNDS ------------------------------------ //
+
+// All the SBs compute their best response to the same snapshot of the forecasts (in parallel, each SB being its own
+// process). The new forecasts are only applied once every SB has answered, then the next snapshot is broadcast.
+var pp_phase_round_data = {};  // a map ID_sb -> FORECAST received during the current round
+
+function planning_jacobi_logic(id, json_obj) {
+
+  console.log('Iter #'+current_planning_iteration+' - Received a Jacobi round message from SB#'+id+residual_info(json_obj));
+  current_planning_iteration += 1;
+
+  pp_phase_round_data[id] = json_obj[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST];
+
+  // Wait for the whole round
+  if (Object.keys(pp_phase_round_data).length < TOTAL_SB_NODES) {
+    return;
+  }
+
+  // Apply the updates of the round
+  sb_pp_ready = [];
+  Object.keys(pp_phase_round_data).forEach(function(sb_id) {
+    var forecast = pp_phase_round_data[sb_id];
+    if (forecast["forecast_data"] == null) {
+      sb_pp_ready.push(parseInt(sb_id));
+    } else {
+      pp_phase_data["sb"][sb_id] = forecast;
+
+      if(SIMU_USE_BLOCKCHAIN) {
+        blockchain_obj.send_power_update(parseInt(sb_id), forecast);
+      }
+    }
+  });
+  pp_phase_round_data = {};
+
+  if(!endof_decentralized_gt_planning()) {  // Next round
+    broadcast_planning_data_signal(CONFIG_OBJ.ZMQ_CONFIG.GROUP_SB_ID, jacobi_snapshot());
+  } else { // stop the algo
+    sb_pp_ready = [];
+    broadcast_planning_phase_end_signal(CONFIG_OBJ.ZMQ_CONFIG.GROUP_SB_ID);
+  }
+}
+
+var jacobi_snapshot = function() {
+  var snapshot = {};
+  snapshot[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST] = forecast_updates("group", pp_phase_data["sb"]);
+  snapshot[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.RESYNC] = forecast_resync;
+  forecast_resync = [];
+  return snapshot;
+}
+
+// ------------------ DECENTRALIZED LOGIC, FORECAST UPDATES ------------------------------------ //
+
+// A SB sends the runs [start, values] of its forecast that changed since its previous version. The coordinator
+// patches its copy, and forwards to each SB only what changed since the version this SB has last received.
+var forecast_last_update = {};  // a map ID_sb -> last update received as runs
+var forecast_seen = {};  // a map receiver (ID_sb, or "group" for the broadcasts) -> {ID_sb -> version last sent}
+var forecast_resync = [];  // the SBs whose whole forecast is requested, after a version gap
+
+var reset_forecast_updates = function() {
+  forecast_last_update = {};
+  forecast_seen = {};
+  forecast_resync = [];
+}
+
+// Returns the whole forecast of a SB, after applying the update it has sent
+function receive_forecast_update(id, forecast) {
+  if (forecast == null || forecast.runs === undefined) {
+    if (forecast != null && forecast.forecast_data != null) {
+      forecast.forecast_data = Array.from(forecast.forecast_data);  // own copy, patched by the next updates
+      delete forecast_last_update[id];
+    }
+    return forecast;
+  }
+
+  var stored = pp_phase_data["sb"][id];
+  if (stored == null || stored.version !== forecast.base_version) {
+    // Version gap: keep the stored forecast and request the whole one
+    console.log('Missed an update of the forecast of SB#'+id+': requesting the whole forecast');
+    if (forecast_resync.indexOf(id) < 0) {
+      forecast_resync.push(id);
+    }
+    return (stored != null) ? stored : {"timestamps": forecast.timestamps, "forecast_data": null};
+  }
+
+  forecast.runs.forEach(function(run) {
+    var values = run[1];
+    for (var k = 0; k < values.length; k++) {
+      stored.forecast_data[run[0] + k] = values[k];
+    }
+  });
+  stored.version = forecast.version;
+  forecast_last_update[id] = forecast;
+
+  return stored;
+}
+
+// A SB has missed some updates: the next messages it receives carry the whole forecasts of these SBs
+function receive_forecast_resync_request(id, list_sb) {
+  if (list_sb === undefined) {
+    return;
+  }
+  list_sb.forEach(function(sb_id) {
+    [id, "group"].forEach(function(receiver) {
+      if (forecast_seen[receiver] !== undefined) {
+        delete forecast_seen[receiver][sb_id];
+      }
+    });
+  });
+}
+
+// The forecasts to send to a receiver: nothing for those it already has, the last runs if it has the previous version,
+// the whole forecast otherwise
+function forecast_updates(receiver, forecasts) {
+  var seen = forecast_seen[receiver] = forecast_seen[receiver] || {};
+  var updates = {};
+
+  Object.keys(forecasts).forEach(function(sb_id) {
+    var stored = forecasts[sb_id];
+    var last_update = forecast_last_update[sb_id];
+
+    if (stored.version === undefined) {  // not versioned
+      updates[sb_id] = stored;
+    } else if (seen[sb_id] === stored.version) {
+      updates[sb_id] = {"timestamps": stored.timestamps, "forecast_data": null, "version": stored.version};
+    } else if (last_update !== undefined && last_update.version === stored.version && seen[sb_id] === last_update.base_version) {
+      updates[sb_id] = last_update;
+    } else {
+      updates[sb_id] = stored;
+    }
+    seen[sb_id] = stored.version;
+  });
+
+  return updates;
+}
+
+// The distance between the new and the former planning of a SB, and the change of its cost, as reported in its reply
+var residual_info = function(json_obj) {
+  var residual = json_obj[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.RESIDUAL];
+  var cost_delta = json_obj[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.COST_DELTA];
+  if (residual === undefined) {
+    return '';
+  }
+  return ' (residual: '+residual+' W, cost delta: '+cost_delta+')';
+}
+
 var endof_decentralized_gt_planning = function() {
   return sb_pp_ready.length >= TOTAL_SB_NODES || current_planning_iteration > TOTAL_SB_NODES * CONFIG_OBJ.SIMULATION_PARAMETERS.PLANNING_MAX_MSG_PER_BUILD;
 }
@@ -458,11 +662,42 @@ var zmq_format_msg = function(type_msg, payload_msg=null) {
   return {"TYPE": type_msg, "DATA": payload_msg};
 }
 
+// The IDs of the entities that receive a message sent to "receiver" (an ID with the "e" suffix, a group or broadcast)
+var wire_receivers = function(receiver) {
+  switch (receiver.toString()) {
+    case BROADCAST_ID.toString():
+      return sb_connected.concat(der_connected, mgm_connected);
+    case CONFIG_OBJ.ZMQ_CONFIG.GROUP_SB_ID.toString():
+      return sb_connected;
+    case CONFIG_OBJ.ZMQ_CONFIG.GROUP_DER_ID.toString():
+      return der_connected;
+    case CONFIG_OBJ.ZMQ_CONFIG.GROUP_MGM_ID.toString():
+      return mgm_connected;
+    default:
+      return [parseInt(receiver)];
+  }
+}
+
+// Binary encoding if all the receivers negotiated it, JSON otherwise
+var wire_encode = function(receiver, msg) {
+  var binary = WIRE_FORMAT == sg_wire.WIRE_FORMAT_BINARY && wire_receivers(receiver).every(function(id) { return wire_binary[id] === true; });
+  return sg_wire.encode(msg, binary ? sg_wire.WIRE_FORMAT_BINARY : sg_wire.WIRE_FORMAT_JSON);
+}
+
+// Acknowledges the registration of an entity, with the wire format it has to use (always sent in JSON)
+var send_connection_ack = function(id, wire_format) {
+  var payload = {};
+  payload[PARAM_OBJ.NEW_CONNECTION_PAYLOAD_KEYS.WIRE_FORMAT] = wire_format;
+
+  var msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.NEW_CONNECTION, payload);
+  publisher.send([id + "e", sg_wire.toJSON(msg)]);
+}
+
 
 // Sends a broadcast message signaling the actors to stop
 var broadcast_stop_signal = function () {
     var msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.STOP);
-    publisher.send([BROADCAST_ID, JSON.stringify(msg)]);
+    publisher.send([BROADCAST_ID, wire_encode(BROADCAST_ID, msg)]);
 };
 
 // Sends a broadcast message signaling the SBs to start their simulation step
@@ -486,13 +721,14 @@ var broadcast_start_step_signal = function(group=null, formatted_param=null) {
       msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.SIMU_STEP);
     }
 
-    publisher.send([group.toString(), JSON.stringify(msg)]);
+    publisher.send([group.toString(), wire_encode(group, msg)]);
 };
 
 // sends a broadcast message for Planning phase: START
 var broadcast_start_planning_signal = function(group=null, data_start=null) {
 
   pp_phase_data = {"der": {}, "sb": {}};
+  reset_forecast_updates();
   var payload = {};
   payload[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.TYPE_SIGNAL] = PARAM_OBJ.PLANNING_SIGNAL_TYPE_SIGNAL.START_TYPE;
 
@@ -511,7 +747,7 @@ var broadcast_start_planning_signal = function(group=null, data_start=null) {
   }
 
   var msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.PLANNING_SIGNAL, payload);
-  publisher.send([group.toString(), JSON.stringify(msg)]);
+  publisher.send([group.toString(), wire_encode(group, msg)]);
 };
 
 // sends a broadcast message for Planning phase: END
@@ -528,7 +764,7 @@ var broadcast_planning_phase_end_signal = function(group, formatted_data=null) {
 
   var msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.PLANNING_SIGNAL, payload);
 
-  publisher.send([group, JSON.stringify(msg)]);
+  publisher.send([group, wire_encode(group, msg)]);
 }
 
 // sends a broadcast message for Planning phase
@@ -545,7 +781,7 @@ var broadcast_planning_data_signal = function(group, formatted_data) {
 
   var msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.PLANNING_SIGNAL, payload);
 
-  publisher.send([group, JSON.stringify(msg)]);
+  publisher.send([group, wire_encode(group, msg)]);
 };
 
 // This function is called in the core of the Game Theory decentralized algo
@@ -554,15 +790,18 @@ var send_decentralized_gt_planning_data = function(id_sb, data_formatted) {
   var payload = {}
   payload[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.TYPE_SIGNAL] = PARAM_OBJ.PLANNING_SIGNAL_TYPE_SIGNAL.DATA_TYPE;
 
-  // Copy the formatted payload k -> v
-  payload[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST] = {};
-  Object.keys(data_formatted).forEach(function(key) {
-    payload[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST][key] = data_formatted[key];
-  });
+  // Only what changed since the previous message to this SB
+  payload[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.CONSUMPTION_FORECAST] = forecast_updates(id_sb, data_formatted);
+
+  // This SB has to send its whole forecast ?
+  if (forecast_resync.indexOf(id_sb) >= 0) {
+    payload[PARAM_OBJ.PLANNING_SIGNAL_PAYLOAD_KEYS.RESYNC] = [id_sb];
+    forecast_resync.splice(forecast_resync.indexOf(id_sb), 1);
+  }
 
   var msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.PLANNING_SIGNAL, payload);
   var id_with_suffix = id_sb + "e";
-  publisher.send([id_with_suffix, JSON.stringify(msg)]);
+  publisher.send([id_with_suffix, wire_encode(id_with_suffix, msg)]);
 }
 
 // Sends the initial info smart-contract simulated as a reply of init
@@ -576,7 +815,7 @@ var send_decentralized_gt_planning_bc_info = function(id_sb, bc_data) {
 
   msg = zmq_format_msg(PARAM_OBJ.SG_COORD_SIGNAL.PLANNING_SIGNAL, payload);
   var id_with_suffix = id_sb + "e";
-  publisher.send([id_with_suffix, JSON.stringify(msg)]);
+  publisher.send([id_with_suffix, wire_encode(id_with_suffix, msg)]);
 }
 
 // ---------
@@ -593,7 +832,7 @@ simulation_frontend_interface.on('start', function(){
     if (CONFIG_OBJ.SIMULATION_PARAMETERS.ROUND_ROBIN_PLANNING == "DESC") { // N -> 1
       sb_connected = sb_connected.reverse();
     } else if (CONFIG_OBJ.SIMULATION_PARAMETERS.ROUND_ROBIN_PLANNING == "RAND") {
-      shuffle(sb_connected);
+      shuffle(sb_connected, {"rng": coordinator_rng});
     }
 
     // Time to trigger the new simu step OR trigger the Planning Phase
@@ -621,6 +860,7 @@ var stop_simu = function() {
     sb_connected = [];
     der_connected = [];
     mgm_connected = [];
+    wire_binary = {};
     current_time = -CONFIG_OBJ.SIMULATION_PARAMETERS.TIME_STEP;
   }
 }
@@ -667,14 +907,18 @@ var ui_send_forecast_data = function(id, data_obj, t) {
   }
 
   var msg = {"ent_type": ent_type, "type_data": type_data, "id": id, "timestamp": t, "data":data_forecast};
-  io.emit('forecast_data', JSON.stringify(msg));
+  io.emit('forecast_data', sg_wire.toJSON(msg));
 };
 
 /// ------------ GLOBAL VARIABLE MANIPULATION ----------------- //
 
+// Returns false if this actor was already registered
 function update_connected_actor(id) {
   type_actor = getDataTypeFromID(id);
   console.log(type_actor)
+  if (sb_connected.concat(der_connected, mgm_connected).indexOf(id) >= 0) {
+    return false;
+  }
   switch (type_actor) {
     case "sb":
       sb_connected.push(id);
@@ -690,6 +934,7 @@ function update_connected_actor(id) {
       break;
     default:
   }
+  return true;
 }
 
 function update_rt_ready_actor(id) {
@@ -735,6 +980,18 @@ function getDataTypeFromID(id) {
   return data_type;
 }
 
+// A pseudo-random generator of numbers in [0, 1) (mulberry32), for the reproducible random draws
+function seeded_rng(seed) {
+  var state = seed >>> 0;
+  return function() {
+    state = (state + 0x6D2B79F5) >>> 0;
+    var t = state;
+    t = Math.imul(t ^ (t >>> 15), t | 1);
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+}
+
 function allActorsAreConnected() {
   return sb_connected.length >= TOTAL_SB_NODES && der_connected.length >= TOTAL_DER_NODES && mgm_connected.length >= TOTAL_MGM_NODES
 }
@@ -112,6 +112,7 @@ def test_statistic(nb_test, average_building_cons, output_folder=None, output_fi
     list_stattest_param.append((('SIMULATION_PARAMETERS','SHUTDOWN_SERVER_UPON_SIMULATION_END'), True))
     list_stattest_param.append((('SIMULATION_PARAMETERS','DURATION'), 0))
     list_stattest_param.append((('SIMULATION_PARAMETERS','PLANNING_MAX_MSG_PER_BUILD'), 20))
+    list_stattest_param.append((('SIMULATION_PARAMETERS','FAST_FORWARD'), True))
     list_stattest_param.append((('SG_SIMULATION_CONFIG','AUTOMATED_SIMULATION'), False))  # TODO: CHANGE THIS BACK !!
 
     write_config_parameters(list_stattest_param)
@@ -1,7 +1,11 @@
 __author__ = 'Olivier Van Cutsem'
 
+import os, inspect
+import heapq
 import numpy as np
 
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
+
 
 class FaultForecast(object):
     """
@@ -11,6 +15,10 @@ class FaultForecast(object):
     TYPE_FORECAST_COEFF_LINEAR = "linear_coeff"
     TYPE_FORECAST_NEW_SIGNAL_FROM_FILE = "new_signal_from_file"
 
+    SIGNAL_FOLDER = "res_fault/"  # the signal files (.npy) are relative to this folder
+
+    _signals = {}  # path -> memory-mapped signal, shared by all the faults of the process
+
     def __init__(self, t_s, t_e, param):
 
         # Start and Ending time of the faults
@@ -22,9 +30,9 @@ class FaultForecast(object):
         if type(param) is float or type(param) is int:  # The parameter is a coefficient that modulates the forecast
             self.type_parameter = FaultForecast.TYPE_FORECAST_COEFF_LINEAR
             self.linear_coefficient = param
-        elif type(param) is str:
+        elif isinstance(param, (str, type(u""))):  # The parameter is the file of a signal that replaces the forecast
             self.type_parameter = FaultForecast.TYPE_FORECAST_NEW_SIGNAL_FROM_FILE
-            self.signal = None  # TODO: read from file
+            self.signal_path = os.path.join(cmd_folder, FaultForecast.SIGNAL_FOLDER, param)
 
     @property
     def starting_time(self):
@@ -34,6 +42,44 @@ class FaultForecast(object):
     def ending_time(self):
         return self.__t_end
 
+    @property
+    def signal(self):
+        """
+        The replacement signal, spread evenly from the starting to the ending time of the fault. It is memory-mapped
+        the first time a fault of the process needs it.
+        """
+        path = os.path.realpath(self.signal_path)
+        signal = FaultForecast._signals.get(path)
+        if signal is None:
+            signal = np.load(path, mmap_mode='r')
+            FaultForecast._signals[path] = signal
+        return signal
+
+    def window_indexes(self, t_0, dt, length):
+        """
+        :return: the indexes (idx_st, idx_end) of the fault in a signal of "length" values sampled every dt from t_0,
+        clipped to the signal
+        """
+        idx_st = min(max(int((self.starting_time - t_0) // dt), 0), length)
+        idx_end = min(max(int((self.ending_time - t_0) // dt), idx_st), length)
+        return idx_st, idx_end
+
+    def replacement_values(self, t_0, dt, idx_st, idx_end):
+        """
+        :return: the values of the replacement signal at the times t_0 + k*dt, for k in [idx_st, idx_end). When the
+        signal is sampled every dt on the same time grid, this is a view of the memory-mapped signal.
+        """
+        signal = self.signal
+        duration = float(self.ending_time - self.starting_time)
+
+        if len(signal) * dt == duration and (t_0 - self.starting_time) % dt == 0:
+            j_st = int((t_0 + idx_st * dt - self.starting_time) // dt)
+            return signal[j_st:j_st + idx_end - idx_st]
+
+        times = t_0 + dt * np.arange(idx_st, idx_end)
+        idx_signal = ((times - self.starting_time) * len(signal) // duration).astype(int)
+        return signal.take(np.clip(idx_signal, 0, len(signal) - 1))
+
     def apply_fault(self, forecast_sig):
         """
         This method takes a forecast signal as a parameter and applies the fault on it
@@ -43,23 +89,86 @@ class FaultForecast(object):
             - sig: the signal data vector
         :return: a signal vector of equal length as "sig", representing the faulted forecast
         """
-        (t_0, dt, sig) = forecast_sig
+        return apply_faults([self], forecast_sig)
 
-        ret = sig
 
-        if self.type_parameter == FaultForecast.TYPE_FORECAST_COEFF_LINEAR:
-            faulted_vector = len(sig) * [1]  # fill with ones
+class FaultSchedule(object):
+    """
+    This class indexes the faults of a Smart-Grid entity by time: the pending faults are kept in a heap ordered by
+    triggering time and the active faults in a heap ordered by ending time, so that activating or ending a fault costs
+    O(log n). Several faults can be active at the same time.
+    """
 
-            # Identify the indexes in faulted_vector whereto apply the coefficient
-            idx_st = (self.starting_time - t_0)/dt
-            idx_end = (self.ending_time - t_0)/dt
-            faulted_vector[idx_st:idx_end] = (idx_end - idx_st) * [self.linear_coefficient]
+    def __init__(self):
+        self.__pending = []  # heap of (t_trigger, seq, fault)
+        self.__active = []  # heap of (t_end, t_trigger, seq, fault)
+        self.__seq = 0  # order of insertion, to break the ties
 
-            ret = np.multiply(faulted_vector, ret).tolist()
-        else:
-            pass  # TODO apply other type of fault
+    def __len__(self):
+        return len(self.__pending) + len(self.__active)
 
-        return ret
+    def add(self, t_trigger, fault):
+        """
+        :param t_trigger: the time at which the fault is activated
+        :param fault: a FaultForecast object
+        """
+        heapq.heappush(self.__pending, (t_trigger, self.__seq, fault))
+        self.__seq += 1
+
+    def update(self, t):
+        """
+        Activate the faults whose triggering time is reached and end the active faults whose ending time is reached
+        :param t: the current time
+        :return: True if at least one fault has been triggered
+        """
+        triggered = False
+        while len(self.__pending) > 0 and self.__pending[0][0] <= t:
+            (t_trigger, seq, fault) = heapq.heappop(self.__pending)
+            heapq.heappush(self.__active, (fault.ending_time, t_trigger, seq, fault))
+            triggered = True
+
+        while len(self.__active) > 0 and self.__active[0][0] <= t:
+            heapq.heappop(self.__active)
+
+        return triggered
+
+    @property
+    def next_trigger(self):
+        """
+        :return: the triggering time of the next pending fault, None if no fault is pending
+        """
+        return self.__pending[0][0] if len(self.__pending) > 0 else None
+
+    @property
+    def active_faults(self):
+        """
+        :return: the list of the active faults, in their triggering order
+        """
+        return [fault for (t_end, t_trigger, seq, fault) in sorted(self.__active, key=lambda f: f[1:3])]
+
+
+def apply_faults(faults, forecast_sig):
+    """
+    Apply several faults on a forecast signal in one pass: the signal is copied once, then each fault, in the given
+    order, scales or replaces its window of the copy in place
+    :param faults: a list of FaultForecast objects
+    :param forecast_sig: a triple (t_0, dt, sig), see FaultForecast.apply_fault
+    :return: a numpy array of equal length as "sig", representing the faulted forecast
+    """
+    (t_0, dt, sig) = forecast_sig
+
+    ret = np.array(sig, dtype=float)
+    for fault in faults:
+        (idx_st, idx_end) = fault.window_indexes(t_0, dt, len(ret))
+        if idx_st == idx_end:
+            continue
+
+        if fault.type_parameter == FaultForecast.TYPE_FORECAST_COEFF_LINEAR:
+            ret[idx_st:idx_end] *= fault.linear_coefficient
+        elif fault.type_parameter == FaultForecast.TYPE_FORECAST_NEW_SIGNAL_FROM_FILE:
+            ret[idx_st:idx_end] = fault.replacement_values(t_0, dt, idx_st, idx_end)
+
+    return ret
 
 
 # TEST
@@ -68,3 +177,12 @@ if __name__ == '__main__':
     test_fault = FaultForecast(12*3600, 18*3600, 0)
     test_forecast = range(0, 96, 1)
     print test_fault.apply_fault((0, 900, test_forecast))
+
+    # Replacement signal whose start is not on the time grid of the forecast
+    import tempfile
+    signal_file = os.path.join(tempfile.mkdtemp(), "test_signal.npy")
+    np.save(signal_file, np.arange(8, dtype=float))
+    test_fault = FaultForecast(1000, 1000 + 8*900, signal_file)
+    test_sig = test_fault.apply_fault((0, 900, np.ones(96)))
+    assert list(test_sig[1:9]) == [0, 0, 1, 2, 3, 4, 5, 6] and test_sig[0] == 1 and test_sig[9] == 1
+    print test_sig[:12]
@@ -0,0 +1,107 @@
+"""
+Daily price signals resampled at the simulation time step
+
+A price signal is a vector of values covering one day with equal slots (e.g. 24 hourly prices). It is resampled once
+per (signal, time step) and the windows (t_s, t_e) of the day are served as read-only views of the resampled vector.
+The signals are looked up by identity; their content is hashed only for a signal not seen yet, e.g. a price received
+again in a new message, to reuse the table of an equal signal.
+"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger('sgEntityProcess.model.priceTable')
+
+DAY_DURATION = 24*3600
+
+
+class PriceTable(object):
+
+    MAX_TABLES = 32  # resampled signals kept in memory by the process
+
+    _tables = OrderedDict()  # (identity of the signal, time step) -> (signal, PriceTable). The signal is kept so that its identity is not reused
+    _contents = OrderedDict()  # (digest of the signal, time step) -> PriceTable
+
+    def __init__(self, signal, time_step):
+        """
+        :param signal: the price values of the day, one per slot of equal duration
+        :param time_step: the time step [s] of the resampled signal
+        """
+        self.time_step = time_step
+        self.values = self.resample(np.asarray(signal), time_step)
+        self.values.flags.writeable = False
+
+    @classmethod
+    def get(cls, signal, time_step):
+        """
+        :param signal: the price values of the day, one per slot of equal duration
+        :param time_step: the time step [s] of the resampled signal
+        :return: the PriceTable of this signal, resampled only the first time it is asked for. The signal must not be
+        modified afterwards.
+        """
+        key = (cls.identity(signal), time_step)
+
+        entry = cls._tables.pop(key, None)
+        if entry is None:
+            content_key = (hashlib.sha1(np.ascontiguousarray(signal, dtype=float).tobytes()).hexdigest(), time_step)
+            table = cls._contents.pop(content_key, None)
+            if table is None:
+                table = PriceTable(signal, time_step)
+                logger.debug("Price signal of %s values resampled at %s s", len(signal), time_step)
+            cls._contents[content_key] = table
+            entry = (signal, table)
+        cls._tables[key] = entry
+
+        for tables in (cls._tables, cls._contents):
+            while len(tables) > cls.MAX_TABLES:
+                tables.popitem(last=False)
+
+        return entry[1]
+
+    @staticmethod
+    def identity(signal):
+        """
+        :return: the identity of a signal: for a numpy array, the memory it covers, so that the views of a same array
+        (e.g. the daily windows of a TimeSeries) share their table; the object itself otherwise
+        """
+        if isinstance(signal, np.ndarray):
+            return signal.__array_interface__['data'][0], signal.shape, signal.strides, signal.dtype.str
+        return id(signal)
+
+    @staticmethod
+    def resample(signal, time_step):
+        """
+        Resample a daily signal at a time step. When each step falls in a single slot of the signal, its value is
+        repeated; otherwise each step takes the time-weighted average of the slots it overlaps
+        :return: a numpy array of ceil(DAY_DURATION / time_step) values
+        """
+        nb_slots = len(signal)
+        nb_steps = int(np.ceil(DAY_DURATION / float(time_step)))
+        steps = np.arange(nb_steps)
+
+        if nb_slots == 0:
+            return np.zeros(nb_steps)
+
+        # Slot of each step, in integer arithmetic: the step k covers [k*time_step, (k+1)*time_step)
+        first_slot = (steps * time_step * nb_slots) // DAY_DURATION
+        last_slot = np.minimum(((steps + 1) * time_step * nb_slots - 1) // DAY_DURATION, nb_slots - 1)
+        if (first_slot == last_slot).all():
+            return signal[first_slot]
+
+        # Integral of the piecewise constant signal at the bounds of the steps
+        slot_bounds = np.arange(nb_slots + 1) * DAY_DURATION / float(nb_slots)
+        integral = np.concatenate(([0.0], np.cumsum(signal * (DAY_DURATION / float(nb_slots)))))
+        step_bounds = np.minimum(np.arange(nb_steps + 1) * float(time_step), DAY_DURATION)
+        step_integral = np.interp(step_bounds, slot_bounds, integral)
+
+        return np.diff(step_integral) / np.diff(step_bounds)
+
+    def window(self, t_s, t_e):
+        """
+        :param t_s: the beginning of the window [s], from the beginning of the day
+        :param t_e: the end of the window [s]
+        :return: a read-only view of the resampled values from t_s to t_e
+        """
+        return self.values[int(t_s / self.time_step):int(t_e / self.time_step)]
@@ -0,0 +1,121 @@
+"""
+Benchmark of the load schedulers and of the backends of the compiled problem, on the same instances
+
+Usage: python sb_backend_bench.py [NB_INSTANCES] [TIME_STEP] [BACKEND ...]
+"""
+
+import os, inspect, sys
+import json
+import time
+import numpy as np
+from sb_scheduler import InteractiveLoadScheduler, EnumerationLoadScheduler, CompiledLoadScheduler
+from sb_problem import BACKENDS
+
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
+
+CONFIG_FILENAME = "../config/entity_data_map.json"
+PRICE_FILENAME = "../config/type_dr_simu_config/GT.json"
+
+
+def generate_instances(nb_instances, time_step, seed=0):
+    """
+    Generate random planning rounds: a building of the catalogue, a starting time, and the consumption and generation of
+    the rest of the microgrid
+    :return: a list of tuples (building_id, time_data, current_schedule, optimization_data)
+    """
+    rng = np.random.RandomState(seed)
+    buildings = json.load(open(cmd_folder + "/" + CONFIG_FILENAME))["buildings"]
+    buildings_id = sorted(buildings.keys(), key=int)
+    hourly_price = json.load(open(cmd_folder + "/" + PRICE_FILENAME))["electricity_price"]
+
+    instances = []
+    for k in range(nb_instances):
+        building_id = buildings_id[rng.randint(len(buildings_id))]
+        t_start = 0 if k % 2 == 0 else time_step * rng.randint(24 * 3600 / time_step / 2)
+        # none of the loads has been launched yet
+        current_schedule = dict((load_id, 24 * 3600) for load_id in buildings[building_id])
+        time_data = (t_start, 24 * 3600, time_step)
+
+        nb_steps = int((24 * 3600 - t_start) / time_step)
+        steps_per_hour = 3600 / time_step
+        price = {}
+        for (name, hourly) in hourly_price.items():
+            price[name] = np.repeat(hourly, steps_per_hour)[-nb_steps:]
+
+        optimization_data = {'price_elec': price,
+                             'external_consumption': rng.randint(0, 20000, nb_steps),
+                             'external_gen': rng.randint(0, 20000, nb_steps)}
+        instances.append((int(building_id), time_data, current_schedule, optimization_data))
+
+    return instances
+
+
+def run_benchmark(instances, schedulers):
+    """
+    Solve each instance with each scheduler and evaluate the cost of the returned schedule
+    :param instances: a list of tuples (building_id, time_data, current_schedule, optimization_data)
+    :param schedulers: a list of tuples (name, function creating a scheduler)
+    :return: a dict name -> list of tuples (solving time, cost), one per instance (None if the solve failed)
+    """
+    results = dict((name, []) for (name, create) in schedulers)
+
+    for (building_id, time_data, current_schedule, optimization_data) in instances:
+        for (name, create) in schedulers:
+            scheduler = create()
+            scheduler.init_loads(building_id, time_data, current_schedule)
+            elec_price, max_power, external_grid_con, remaining_gen = scheduler.extract_optimization_data(time_data, optimization_data)
+
+            t = time.time()
+            try:
+                schedule = scheduler.schedule_loads(time_data, optimization_data)
+            except Exception:
+                schedule = None
+            elapsed = time.time() - t
+
+            if schedule is None:
+                results[name].append(None)
+                continue
+
+            power = scheduler.schedule_power_vector(schedule, time_data)
+            results[name].append((elapsed, scheduler.evaluate_cost(power, elec_price, external_grid_con, remaining_gen)))
+
+    return results
+
+
+def format_results(results):
+    """
+    :return: a table (string) with the solving times and the gap to the best cost of each instance
+    """
+    names = sorted(results.keys())
+    nb_instances = len(results[names[0]])
+    best_costs = [min(results[n][k][1] for n in names if results[n][k] is not None) for k in range(nb_instances)]
+
+    lines = ["{:<16}{:>8}{:>12}{:>12}{:>14}".format("scheduler", "failed", "mean [s]", "max [s]", "mean gap [%]")]
+    for n in names:
+        solved = [(k, r) for (k, r) in enumerate(results[n]) if r is not None]
+        times = [r[0] for (k, r) in solved] or [np.nan]
+        gaps = [100.0 * (r[1] - best_costs[k]) / max(abs(best_costs[k]), 1e-9) for (k, r) in solved] or [np.nan]
+        lines.append("{:<16}{:>8}{:>12.4f}{:>12.4f}{:>14.4f}".format(n, nb_instances - len(solved), np.mean(times), np.max(times), np.mean(gaps)))
+
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+
+    nb_instances = 20
+    time_step = 900
+    backends = sorted(BACKENDS.keys())
+    if len(sys.argv) > 1:
+        nb_instances = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        time_step = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        backends = sys.argv[3:]
+
+    schedulers = [("MILP", lambda: InteractiveLoadScheduler(CONFIG_FILENAME)),
+                  ("EXACT", lambda: EnumerationLoadScheduler(CONFIG_FILENAME))]
+    for b in backends:
+        schedulers.append(("COMPILED_" + b, lambda b=b: CompiledLoadScheduler(CONFIG_FILENAME, b)))
+
+    instances = generate_instances(nb_instances, time_step)
+    print(format_results(run_benchmark(instances, schedulers)))
@@ -0,0 +1,439 @@
+"""
+Compiled form of the load scheduling problem of InteractiveLoadScheduler, and the solver backends that consume it
+
+The problem is compiled once per planning phase into arrays (objective vector, quadratic diagonal, CSR constraint
+matrices, bounds), without building any expression term by term. Only the objective and the bounds depending on the
+rest of the microgrid are updated at each round.
+
+Variables, in this order:
+ - x[k]: 1 if the load x_load[k] starts at interval x_start[k] (only the feasible starts)
+ - y_i_m[i]: consumption of the loads from the grid at interval i
+ - y_i_res[i]: consumption of the loads from the remaining local generation at interval i
+
+Backends:
+ - GUROBI: gurobipy matrix API (needs gurobipy >= 9)
+ - HIGHS: scipy.optimize.milp (needs scipy >= 1.9)
+ - CBC: PuLP with its default CBC solver
+HIGHS and CBC are linear solvers: the quadratic term is replaced by tangent cuts (see linearized())
+"""
+
+import copy
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger('sgEntityProcess.model.sbProblem')
+
+
+class CsrMatrix(object):
+    """
+    A sparse matrix in Compressed Sparse Row format, that only depends on numpy
+    """
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = shape
+
+    @classmethod
+    def from_coo(cls, rows, cols, vals, shape):
+        """
+        Build a CSR matrix from (row, col, value) triplets
+        """
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(shape[0] + 1, dtype=int)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=shape[0]))
+        return cls(np.asarray(vals, dtype=float)[order], np.asarray(cols, dtype=int)[order], indptr, shape)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def row(self, i):
+        """
+        :return: a tuple (indices, data) of the non-zero elements of row i
+        """
+        return self.indices[self.indptr[i]:self.indptr[i+1]], self.data[self.indptr[i]:self.indptr[i+1]]
+
+    def dot(self, v):
+        """
+        :return: the product of the matrix with the vector v
+        """
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        return np.bincount(rows, weights=self.data * np.asarray(v, dtype=float)[self.indices], minlength=self.shape[0])
+
+    def to_scipy(self):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+def vstack_csr(matrices, nb_cols):
+    """
+    Stack CSR matrices vertically
+    """
+    data = np.concatenate([a.data for a in matrices])
+    indices = np.concatenate([a.indices for a in matrices])
+    indptr = [np.zeros(1, dtype=int)]
+    offset = 0
+    for a in matrices:
+        indptr.append(a.indptr[1:] + offset)
+        offset += a.nnz
+    return CsrMatrix(data, indices, np.concatenate(indptr), (sum(a.shape[0] for a in matrices), nb_cols))
+
+
+class CompiledSchedulingProblem(object):
+    """
+    min  sum(q * v^2) + c.v + const
+    s.t. a_eq.v = b_eq
+         a_ub.v <= b_ub
+         lb <= v <= ub, v[integrality] integer
+    """
+
+    def __init__(self, power_profiles, starts, interval_number, max_power=None):
+        """
+        Compile the structure of the problem
+        :param power_profiles: the power profile of each load
+        :param starts: the feasible starting intervals of each load
+        :param interval_number: number of intervals of the horizon
+        :param max_power: the maximum power of the loads, or None
+        """
+
+        nb_loads = len(power_profiles)
+        power_profiles = [np.asarray(p, dtype=float) for p in power_profiles]
+        lengths = np.array([len(p) for p in power_profiles], dtype=int)
+
+        # Starting variables: one per feasible (load, start) pair
+        self.x_load = np.concatenate([np.zeros(0, dtype=int)] + [np.full(len(s), j, dtype=int) for (j, s) in enumerate(starts)])
+        self.x_start = np.concatenate([np.zeros(0, dtype=int)] + [np.asarray(s, dtype=int) for s in starts])
+        nb_x = len(self.x_start)
+
+        self.interval_number = interval_number
+        self.nb_vars = nb_x + 2 * interval_number
+        self.x_idx = np.arange(nb_x)
+        self.y_m_idx = nb_x + np.arange(interval_number)
+        self.y_res_idx = nb_x + interval_number + np.arange(interval_number)
+
+        # Power of the loads at each interval: the non-zeros (interval, x, power) of all the placed profiles
+        x_lengths = lengths[self.x_load]
+        nz_x = np.repeat(self.x_idx, x_lengths)
+        nz_offset = np.arange(x_lengths.sum()) - np.repeat(np.cumsum(x_lengths) - x_lengths, x_lengths)
+        profile_first = np.cumsum(lengths) - lengths
+        nz_power = np.concatenate([np.zeros(0)] + power_profiles)[profile_first[self.x_load][nz_x] + nz_offset]
+        nz_interval = self.x_start[nz_x] + nz_offset
+
+        # Equality constraints:
+        # - one start per load
+        # - power of the loads = y_i_m + y_i_res, at each interval
+        intervals = np.arange(interval_number)
+        rows = np.concatenate((self.x_load, nb_loads + nz_interval, nb_loads + intervals, nb_loads + intervals))
+        cols = np.concatenate((self.x_idx, nz_x, self.y_m_idx, self.y_res_idx))
+        vals = np.concatenate((np.ones(nb_x), nz_power, -np.ones(interval_number), -np.ones(interval_number)))
+        self.a_eq = CsrMatrix.from_coo(rows, cols, vals, (nb_loads + interval_number, self.nb_vars))
+        self.b_eq = np.concatenate((np.ones(nb_loads), np.zeros(interval_number)))
+
+        # Inequality constraints: max power
+        if max_power is not None:
+            self.a_ub = CsrMatrix.from_coo(nz_interval, nz_x, nz_power, (interval_number, self.nb_vars))
+            self.b_ub = np.full(interval_number, float(max_power))
+        else:
+            self.a_ub = CsrMatrix.from_coo(np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0), (0, self.nb_vars))
+            self.b_ub = np.zeros(0)
+
+        # Upper bound of the power of the loads at each interval (each load at its worst start)
+        max_load_power = np.zeros((nb_loads, interval_number))
+        np.maximum.at(max_load_power, (self.x_load[nz_x], nz_interval), nz_power)
+        self.max_power_interval = max_load_power.sum(axis=0)
+
+        # Bounds and integrality
+        self.lb = np.zeros(self.nb_vars)
+        self.ub = np.full(self.nb_vars, np.inf)
+        self.ub[self.x_idx] = 1.0
+        self.integrality = np.zeros(self.nb_vars, dtype=bool)
+        self.integrality[self.x_idx] = True
+
+        # Objective: set by set_data()
+        self.c = np.zeros(self.nb_vars)
+        self.q = np.zeros(self.nb_vars)
+        self.const = 0.0
+
+    def set_data(self, elec_price, external_grid_con, remaining_gen):
+        """
+        Update the objective and the bounds with the data coming from the rest of the microgrid
+        :param elec_price: a dictionary containing the keys: "energy_price", "quad_price", and "local_price"
+        :param external_grid_con: the consumption from the grid of the rest of the microgrid, at each interval
+        :param remaining_gen: the local generation left by the rest of the microgrid, at each interval
+        :return: /
+        """
+
+        n = self.interval_number
+        zeros = np.zeros(n)
+        external_grid_con = np.asarray(external_grid_con, dtype=float)
+        energy_price = np.asarray(elec_price.get("energy_price", zeros), dtype=float)[:n]
+        local_price = np.asarray(elec_price.get("local_price", zeros), dtype=float)[:n]
+        quad_price = zeros
+        if "quad_price" in elec_price.keys() and sum(external_grid_con) > 0:
+            quad_price = np.asarray(elec_price["quad_price"], dtype=float)[:n]
+
+        # (y_i_m^2 + 2 y_i_m ext) * quad + (y_i_m + ext) * energy + y_i_res * local, in kW
+        self.q[:] = 0.0
+        self.q[self.y_m_idx] = quad_price / 10.0**6
+        self.c[:] = 0.0
+        self.c[self.y_m_idx] = 2 * quad_price * external_grid_con / 10.0**6 + energy_price / 1000.0
+        self.c[self.y_res_idx] = local_price / 1000.0
+        self.const = float(np.dot(energy_price, external_grid_con) / 1000.0)
+
+        # consumption from RES smaller than remaining RES generation
+        self.ub[self.y_res_idx] = remaining_gen
+
+    def objective(self, v):
+        """
+        :return: the value of the objective function for the solution v
+        """
+        return float(np.dot(self.q * v, v) + np.dot(self.c, v) + self.const)
+
+    def is_feasible(self, v, tol=1e-6):
+        """
+        :param tol: the tolerance on the integrality and the bounds, and on each constraint relative to the magnitude
+        of its terms
+        :return: True if v satisfies the bounds, the constraints and the integrality of the problem
+        """
+        v = np.asarray(v, dtype=float)
+        if len(v) != self.nb_vars:
+            return False
+
+        def scale(a, b):
+            return tol * (1 + abs(b) + CsrMatrix(abs(a.data), a.indices, a.indptr, a.shape).dot(abs(v)))
+
+        return bool((v >= self.lb - tol * (1 + abs(self.lb))).all() and (v <= self.ub + tol * (1 + abs(self.ub))).all()
+                    and (abs(self.a_eq.dot(v) - self.b_eq) <= scale(self.a_eq, self.b_eq)).all()
+                    and (self.a_ub.dot(v) - self.b_ub <= scale(self.a_ub, self.b_ub)).all()
+                    and (abs(v[self.integrality] - np.round(v[self.integrality])) <= tol).all())
+
+    def linearized(self, segments):
+        """
+        Linear version of the problem, for the solvers without quadratic objective: each quadratic term q*y^2 is
+        replaced by a variable t >= q*y^2, approximated by its tangents at segments+1 points from 0 to the
+        maximum power of the interval
+        :param segments: number of segments of the approximation
+        :return: a CompiledSchedulingProblem with the extra variables t appended and a zero quadratic diagonal
+        """
+
+        quad_vars = np.nonzero(self.q)[0]
+        if len(quad_vars) == 0:
+            return self
+
+        lin = copy.copy(self)
+        nb_t = len(quad_vars)
+        t_idx = self.nb_vars + np.arange(nb_t)
+        lin.nb_vars = self.nb_vars + nb_t
+
+        q = self.q[quad_vars]
+        y_max = np.maximum(self.max_power_interval[quad_vars - self.y_m_idx[0]], 1.0)
+
+        # tangent at a: t >= q * (2 a y - a^2)  <=>  2 q a y - t <= q a^2
+        a = y_max[:, np.newaxis] * np.linspace(0.0, 1.0, segments + 1)[np.newaxis, :]
+        rows = np.arange(nb_t * (segments + 1))
+        cuts = CsrMatrix.from_coo(np.concatenate((rows, rows)),
+                                  np.concatenate((np.repeat(quad_vars, segments + 1), np.repeat(t_idx, segments + 1))),
+                                  np.concatenate(((2 * q[:, np.newaxis] * a).ravel(), -np.ones(len(rows)))),
+                                  (len(rows), lin.nb_vars))
+
+        lin.a_eq = CsrMatrix(self.a_eq.data, self.a_eq.indices, self.a_eq.indptr, (self.a_eq.shape[0], lin.nb_vars))
+        lin.a_ub = vstack_csr([CsrMatrix(self.a_ub.data, self.a_ub.indices, self.a_ub.indptr, (self.a_ub.shape[0], lin.nb_vars)), cuts], lin.nb_vars)
+        lin.b_ub = np.concatenate((self.b_ub, (q[:, np.newaxis] * a ** 2).ravel()))
+        lin.lb = np.append(self.lb, np.zeros(nb_t))
+        lin.ub = np.append(self.ub, np.full(nb_t, np.inf))
+        lin.integrality = np.append(self.integrality, np.zeros(nb_t, dtype=bool))
+        lin.c = np.append(self.c, np.ones(nb_t))
+        lin.q = np.zeros(lin.nb_vars)
+
+        return lin
+
+    def starts_from_solution(self, v):
+        """
+        :return: the list of (load index, starting interval) selected by the solution v
+        """
+        selected = np.nonzero(np.round(v[self.x_idx]) == 1)[0]
+        return list(zip(self.x_load[selected].tolist(), self.x_start[selected].tolist()))
+
+
+# ----------- The backends
+
+class SchedulingBackend(object):
+    """
+    A solver of CompiledSchedulingProblem
+    """
+
+    def __init__(self, options=None):
+        self.options = options or {}
+
+        # A dict describing the last solve: 'status', 'gap' (None if unknown) and 'runtime' [s]
+        self.info = None
+
+    def solve(self, problem):
+        """
+        Solve the problem, within the options "time_limit" [s] and "mip_gap" (relative) if they are given, with
+        "threads" threads if the solver supports it
+        :param problem: a CompiledSchedulingProblem
+        :return: the solution vector (the best incumbent if the time limit is reached), or None if no solution has
+        been found
+        """
+        raise NotImplementedError
+
+
+class GurobiMatrixBackend(SchedulingBackend):
+    """
+    gurobipy matrix API. The model is kept between the calls with the same problem structure: only the objective and
+    the bounds are updated and the previous solution is the starting point of the next optimization
+    """
+
+    STATUS_NAMES = {2: "OPTIMAL", 3: "INFEASIBLE", 4: "INF_OR_UNBD", 9: "TIME_LIMIT", 11: "INTERRUPTED", 13: "SUBOPTIMAL"}
+
+    def __init__(self, options=None):
+        super(GurobiMatrixBackend, self).__init__(options)
+        self._model = None
+        self._problem_id = None
+
+    def solve(self, problem):
+        import gurobipy as grb
+        from scipy.sparse import diags
+
+        if self._model is None or self._problem_id != id(problem):
+            m = grb.Model("compiled")
+            m.setParam('OutputFlag', False)
+            if self.options.get("time_limit") is not None:
+                m.setParam('TimeLimit', self.options["time_limit"])
+            if self.options.get("mip_gap") is not None:
+                m.setParam('MIPGap', self.options["mip_gap"])
+            if self.options.get("threads") is not None:
+                m.setParam('Threads', self.options["threads"])
+            vtypes = np.where(problem.integrality, grb.GRB.BINARY, grb.GRB.CONTINUOUS)
+            v = m.addMVar(problem.nb_vars, lb=problem.lb, ub=problem.ub, vtype=vtypes)
+            add_mconstr = getattr(m, 'addMConstr', None) or m.addMConstrs  # renamed in gurobipy 9.5
+            if problem.a_eq.shape[0] > 0:
+                add_mconstr(problem.a_eq.to_scipy(), v, grb.GRB.EQUAL, problem.b_eq)
+            if problem.a_ub.shape[0] > 0:
+                add_mconstr(problem.a_ub.to_scipy(), v, grb.GRB.LESS_EQUAL, problem.b_ub)
+            self._model, self._v, self._problem_id = m, v, id(problem)
+
+        m, v = self._model, self._v
+        v.setAttr(grb.GRB.Attr.UB, problem.ub)
+        q = diags(problem.q) if problem.q.any() else None
+        m.setMObjective(q, problem.c, problem.const, sense=grb.GRB.MINIMIZE)
+        m.optimize()
+
+        self.info = {'status': self.STATUS_NAMES.get(m.Status, str(m.Status)),
+                     'gap': m.MIPGap if m.SolCount > 0 and np.isfinite(m.MIPGap) else None,
+                     'runtime': m.Runtime}
+
+        if m.SolCount == 0:
+            return None
+
+        solution = np.array(v.X)
+        v.setAttr(grb.GRB.Attr.Start, solution)
+        return solution
+
+
+class HighsBackend(SchedulingBackend):
+    """
+    HiGHS through scipy.optimize.milp, on the linearized problem. scipy does not expose the number of threads
+    """
+
+    PWL_SEGMENTS = 16
+
+    STATUS_NAMES = {0: "OPTIMAL", 1: "TIME_LIMIT", 2: "INFEASIBLE", 3: "UNBOUNDED"}
+
+    def solve(self, problem):
+        from scipy.optimize import milp, LinearConstraint, Bounds
+
+        lin = problem.linearized(self.options.get("pwl_segments", self.PWL_SEGMENTS))
+
+        constraints = []
+        if lin.a_eq.shape[0] > 0:
+            constraints.append(LinearConstraint(lin.a_eq.to_scipy(), lin.b_eq, lin.b_eq))
+        if lin.a_ub.shape[0] > 0:
+            constraints.append(LinearConstraint(lin.a_ub.to_scipy(), -np.inf, lin.b_ub))
+
+        milp_options = {}
+        if self.options.get("time_limit") is not None:
+            milp_options["time_limit"] = self.options["time_limit"]
+        if self.options.get("mip_gap") is not None:
+            milp_options["mip_rel_gap"] = self.options["mip_gap"]
+
+        t = time.time()
+        res = milp(lin.c, constraints=constraints, integrality=lin.integrality.astype(int), bounds=Bounds(lin.lb, lin.ub),
+                   options=milp_options)
+
+        self.info = {'status': self.STATUS_NAMES.get(res.status, str(res.status)),
+                     'gap': getattr(res, 'mip_gap', None) if res.x is not None else None,
+                     'runtime': time.time() - t}
+
+        if res.x is None:
+            return None
+
+        return res.x[:problem.nb_vars]
+
+
+class PulpCbcBackend(SchedulingBackend):
+    """
+    PuLP with CBC, on the linearized problem. The PuLP expressions are built row by row from the CSR matrices
+    """
+
+    PWL_SEGMENTS = 16
+
+    def solve(self, problem):
+        import pulp
+
+        lin = problem.linearized(self.options.get("pwl_segments", self.PWL_SEGMENTS))
+
+        prob = pulp.LpProblem('compiled', pulp.LpMinimize)
+        v = [pulp.LpVariable('v{}'.format(k), lowBound=lin.lb[k], upBound=(lin.ub[k] if np.isfinite(lin.ub[k]) else None),
+                             cat=(pulp.LpInteger if lin.integrality[k] else pulp.LpContinuous)) for k in range(lin.nb_vars)]
+
+        prob += pulp.LpAffineExpression([(v[k], lin.c[k]) for k in np.nonzero(lin.c)[0]], constant=lin.const)
+
+        for (a, b, sense) in [(lin.a_eq, lin.b_eq, pulp.LpConstraintEQ), (lin.a_ub, lin.b_ub, pulp.LpConstraintLE)]:
+            for i in range(a.shape[0]):
+                indices, data = a.row(i)
+                prob += pulp.LpConstraint(pulp.LpAffineExpression([(v[k], val) for (k, val) in zip(indices, data)]), sense, rhs=b[i])
+
+        # CBC command line options, understood by all the versions of PuLP
+        cbc_options = []
+        if self.options.get("time_limit") is not None:
+            cbc_options += ['sec', str(self.options["time_limit"])]
+        if self.options.get("mip_gap") is not None:
+            cbc_options += ['ratio', str(self.options["mip_gap"])]
+        if self.options.get("threads") is not None:
+            cbc_options += ['threads', str(self.options["threads"])]
+
+        t = time.time()
+        prob.solve(pulp.PULP_CBC_CMD(msg=0, options=cbc_options))
+
+        self.info = {'status': pulp.LpStatus[prob.status].upper(), 'gap': None, 'runtime': time.time() - t}
+
+        if prob.status != pulp.LpStatusOptimal:
+            # CBC stopped by its time limit is reported as "Not Solved", with its incumbent if it found one. Without
+            # an incumbent, the values read back are those of the relaxation: they are not a solution.
+            if prob.status != pulp.LpStatusNotSolved or self.options.get("time_limit") is None \
+                    or any(var.varValue is None for var in v) or not lin.is_feasible([var.varValue for var in v]):
+                return None
+            self.info['status'] = "TIME_LIMIT"
+
+        return np.array([var.varValue or 0.0 for var in v[:problem.nb_vars]])
+
+
+BACKENDS = {
+    "GUROBI": GurobiMatrixBackend,
+    "HIGHS": HighsBackend,
+    "CBC": PulpCbcBackend
+}
+
+
+def get_backend(name, options=None):
+    """
+    :param name: the name of the backend: one of the keys of BACKENDS
+    :param options: a dict of options of the backend
+    :return: a SchedulingBackend object
+    """
+    return BACKENDS[name](options)
@@ -12,6 +12,9 @@ import numpy as np
 import logging
 from gurobipy import *
 import time
+import hashlib
+from collections import OrderedDict
+from sb_problem import CompiledSchedulingProblem, get_backend
 
 cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
 logger = logging.getLogger('sgEntityProcess.model.sbScheduler')
@@ -19,6 +22,8 @@ logger = logging.getLogger('sgEntityProcess.model.sbScheduler')
 
 class Load(object):
 
+    __slots__ = ('_id', '_power', '_st', '_et')
+
     def __init__(self, id, power, st, et):
         self._id = id
         self._power = power
@@ -42,6 +47,153 @@ class Load(object):
         return self._et
 
 
+# The loads to schedule, as a struct of arrays: the power profiles are the rows of a zero-padded matrix
+# Indexing or iterating gives LoadView objects, that behave as Load objects without copying anything
+class LoadSet(object):
+
+    __slots__ = ('ids', 'power', 'lengths', 'st', 'et', 'row')
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=int)  # the load IDs
+        self.power = np.zeros((0, 0), dtype=int)  # (loads x max length) power profiles [W], padded with zeros
+        self.lengths = np.zeros(0, dtype=int)  # the number of samples of each power profile
+        self.st = np.zeros(0, dtype=int)  # the earliest starting times [s]
+        self.et = np.zeros(0, dtype=int)  # the latest ending times [s]
+        self.row = {}  # load ID -> row in the arrays
+
+    def append(self, id, power, st, et):
+        """
+        Add a load at the end of the set
+        """
+        power = np.asarray(power)
+        nb_loads, width = self.power.shape
+
+        new_power = np.zeros((nb_loads + 1, max(width, len(power))), dtype=np.result_type(self.power.dtype, power.dtype))
+        new_power[:nb_loads, :width] = self.power
+        new_power[nb_loads, :len(power)] = power
+        new_power.flags.writeable = False
+
+        self.power = new_power
+        self.ids = np.append(self.ids, id)
+        self.lengths = np.append(self.lengths, len(power))
+        self.st = np.append(self.st, st)
+        self.et = np.append(self.et, et)
+        self.row[id] = nb_loads
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, j):
+        if not -len(self.ids) <= j < len(self.ids):
+            raise IndexError(j)
+        return LoadView(self, j % len(self.ids))
+
+    def __iter__(self):
+        for j in range(len(self.ids)):
+            yield LoadView(self, j)
+
+
+class LoadView(object):
+
+    __slots__ = ('_loads', '_row')
+
+    def __init__(self, loads, row):
+        self._loads = loads
+        self._row = row
+
+    @property
+    def id(self):
+        return self._loads.ids[self._row].item()
+
+    @property
+    def power(self):
+        return self._loads.power[self._row, :self._loads.lengths[self._row]]
+
+    @property
+    def st(self):
+        return self._loads.st[self._row].item()
+
+    @property
+    def et(self):
+        return self._loads.et[self._row].item()
+
+
+# Catalogue of the shiftable loads of the buildings, shared by all the schedulers of the process
+# The data map is parsed once and the interpolated power profiles are cached per (load, time step), as read-only arrays
+# Everything is reloaded when the modification time of the file changes
+class LoadCatalogue(object):
+
+    TIME_STEP_LOAD_PROFILE = 15*60
+
+    _catalogues = {}
+
+    def __init__(self, path):
+        self._path = path
+        self._mtime = None
+        self._loads = []
+        self._loads_by_id = {}
+        self._buildings = {}
+        self._profiles = {}
+
+    @classmethod
+    def get(cls, path):
+        """
+        :param path: the path of the data map
+        :return: the catalogue of this data map, up to date with the file
+        """
+        path = os.path.realpath(path)
+        if path not in cls._catalogues:
+            cls._catalogues[path] = LoadCatalogue(path)
+
+        catalogue = cls._catalogues[path]
+        catalogue.refresh()
+        return catalogue
+
+    def refresh(self):
+        """
+        Reload the data map if it has been modified since the last parsing
+        """
+        mtime = os.path.getmtime(self._path)
+        if mtime == self._mtime:
+            return
+
+        building_info = json.load(open(self._path))
+        self._loads = [(int(load), val) for (load, val) in building_info["loads"].items()]
+        self._loads_by_id = dict(self._loads)
+        self._buildings = dict((int(b), set(loads)) for (b, loads) in building_info["buildings"].items())
+        self._profiles = {}
+        self._mtime = mtime
+        logger.debug("Load catalogue %s parsed: %s loads, %s buildings", self._path, len(self._loads), len(self._buildings))
+
+    def loads(self):
+        """
+        :return: a list of tuples (load_id, load_data), in the order of the data map
+        """
+        return self._loads
+
+    def building_loads(self, building_id):
+        """
+        :return: the set of the IDs of the loads of the building
+        """
+        return self._buildings[int(building_id)]
+
+    def power_profile(self, load_id, time_step):
+        """
+        :param load_id: the ID of the load
+        :param time_step: the time step [s] of the profile
+        :return: the power profile [W] of the load, interpolated at the time step (read-only numpy array)
+        """
+        key = (load_id, time_step)
+        if key not in self._profiles:
+            power = self._loads_by_id[load_id]["power"]
+            n = len(power)
+            pow = np.interp(np.linspace(time_step, n*time_step, (n*self.TIME_STEP_LOAD_PROFILE/time_step)), np.linspace(self.TIME_STEP_LOAD_PROFILE, n*self.TIME_STEP_LOAD_PROFILE, n), power).astype(int)
+            pow.flags.writeable = False
+            self._profiles[key] = pow
+
+        return self._profiles[key]
+
+
 # Load Scheduler class
 # the building_info file configuration is supposed to be known
 # In it, the loads are defined with a 15min interval, and the electricity price signal with an 1h interval
@@ -51,34 +203,31 @@ class OptiLoadScheduler(object):
     TIME_STEP_LOAD_PROFILE = 15*60
 
     def __init__(self, config_path):
-        # list of Load objects
-        self._list_shift_loads = []
+        # the loads to schedule
+        self._list_shift_loads = LoadSet()
         self._config_path = config_path
 
     # init the list of Load objects for the corresponding building
-    # interpolates the value based on default 15min-load indexing (in config) (hardcoded)
+    # the power profiles are interpolated from the default 15min-load indexing (in config) by the LoadCatalogue
     # assumption : one load can be used only once
     def init_loads(self, building_id, time_data, current_schedule):
         t_start, t_end, time_step = time_data
-        building_info = json.load(open(cmd_folder+"/"+self._config_path))
+        catalogue = LoadCatalogue.get(cmd_folder+"/"+self._config_path)
+        building_loads = catalogue.building_loads(building_id)
 
         # if we are in day-ahead phase (loads are not scheduled yet)
         if t_start == 0:
-            for (load, val) in building_info["loads"].items():
-                if int(load) in building_info["buildings"][str(building_id)]:
-                    pow = np.interp(np.linspace(time_step, len(val["power"])*time_step, (len(val["power"])*self.TIME_STEP_LOAD_PROFILE/time_step)), np.linspace(self.TIME_STEP_LOAD_PROFILE, len(val["power"])*self.TIME_STEP_LOAD_PROFILE, len(val["power"])), val["power"]).astype(int)
-                    l = Load(int(load), pow, val["st"], val["et"])
-                    self._list_shift_loads.append(l)
+            for (load, val) in catalogue.loads():
+                if load in building_loads:
+                    self._list_shift_loads.append(load, catalogue.power_profile(load, time_step), val["st"], val["et"])
 
         # if day has started and microgrid is updating it's forecast
         else:
-            for (load, val) in building_info["loads"].items():
-                if int(load) in building_info["buildings"][str(building_id)]:
+            for (load, val) in catalogue.loads():
+                if load in building_loads:
                     # takes loads that haven't been launched yet
-                    if current_schedule.get(int(load)) >= t_start:
-                        pow = np.interp(np.linspace(time_step, len(val["power"])*time_step, (len(val["power"])*self.TIME_STEP_LOAD_PROFILE/time_step)), np.linspace(self.TIME_STEP_LOAD_PROFILE, len(val["power"])*self.TIME_STEP_LOAD_PROFILE, len(val["power"])), val["power"]).astype(int)
-                        l = Load(int(load), pow, max(val["st"] - t_start, 0), max(val["et"] - t_start, 0))
-                        self._list_shift_loads.append(l)
+                    if current_schedule.get(load) >= t_start:
+                        self._list_shift_loads.append(load, catalogue.power_profile(load, time_step), max(val["st"] - t_start, 0), max(val["et"] - t_start, 0))
 
     def schedule_loads(self, time_data, optimization_data):
         """
@@ -116,10 +265,7 @@ class OptiLoadScheduler(object):
         # List with all possible load states
         states = [(j, i) for j in loads_range for i in intervals]
         # Creation of f cost function, vector (cost of electricity for each t.i for each load)
-        en_cost = []
-        for j in range(0, len(self._list_shift_loads)):  # foreach load j
-            en_cost.append([self.energy_cost_turn_on(elec_price, j, i, dt / 3600.0, sampling_rate) for i in
-                            range(0, interval_number)])  # append sublist of all intervals i
+        en_cost = self.energy_cost_matrix(elec_price, interval_number, dt / 3600.0).tolist()
 
         # ------------- PuLP ------------------
         # Creation of PuLP variables containing the MILP problem data
@@ -196,25 +342,117 @@ class OptiLoadScheduler(object):
 
         return cost
 
+    def energy_cost_matrix(self, elec_price, interval_number, dt):
+        """
+        Batched version of energy_cost_turn_on: computes the cost in energy to turn on each load at each interval,
+        as a sliding-window dot product of the load power profiles with the price vector
+
+        :param elec_price: electricity price vector
+        :param interval_number: number of intervals (columns of the returned matrix)
+        :param dt:  time interval [hours]
+        :return:    a (loads x intervals) numpy array; the cost is 10**6 when the load would run outside of the price vector
+        """
+
+        # The price is given in dollar/kWh, and here we want cent/Wh, so need to divide by 10 (* 100 / 1000)
+        adjust_factor = 1/10.0
+
+        loads = self._list_shift_loads
+        nb_loads = len(loads)
+        if nb_loads == 0:
+            return np.zeros((0, interval_number))
+
+        # Zero-padded power matrix: one row per load
+        lengths = loads.lengths
+        max_len = max(lengths.max(), 1)
+        power = np.zeros((nb_loads, max_len))
+        power[:, :loads.power.shape[1]] = loads.power
+
+        # Zero-padded price, viewed as (intervals x max_len) sliding windows without copy
+        price = np.asarray(elec_price, dtype=float)
+        padded_price = np.zeros(interval_number + max_len - 1)
+        nb_prices = min(len(price), len(padded_price))
+        padded_price[:nb_prices] = price[:nb_prices]
+        windows = np.lib.stride_tricks.as_strided(padded_price, shape=(interval_number, max_len),
+                                                  strides=(padded_price.strides[0], padded_price.strides[0]))
+
+        en_cost = power.dot(windows.T) * dt * adjust_factor
+
+        # prevents looking at prices outside of area of interest
+        out_of_horizon = (np.arange(interval_number)[np.newaxis, :] + lengths[:, np.newaxis] > len(price)) & (lengths[:, np.newaxis] > 0)
+        en_cost[out_of_horizon] = 10**6
+
+        return en_cost
+
+    def feasible_starts(self, num_load, interval_number, dt):
+        """
+        Auxiliary method that computes the intervals at which load num_load can be turned on: the load must
+        run entirely inside the horizon and start within its time window [st, et - len(power)]
+
+        :param num_load: number of current load
+        :param interval_number: number of intervals of the horizon
+        :param dt:  time interval [seconds]
+        :return:    the list of the feasible starting intervals
+        """
+
+        loads = self._list_shift_loads
+        nb_samples = int(loads.lengths[num_load])
+
+        first_interval = max(int(np.ceil(loads.st[num_load] / float(dt))), 0)
+        last_interval = min(interval_number - nb_samples, int(np.floor((loads.et[num_load] - nb_samples) / float(dt))))
+
+        return range(first_interval, last_interval + 1)
+
     # converts a load time start dict in a complete power profile
     def schedule_power_vector(self, schedule, time_data):
 
         # Extract the time info
         t_start, t_end, time_step = time_data
 
-        p = np.array([0 for i in range(int((t_end-t_start)/time_step))])
-        for l_id, sch_time in sorted(schedule.items()):
-            rel_sch_time = (sch_time-t_start)  # sch_time is an absolute value in the day
-            for load in self._list_shift_loads:
-                if load.id == l_id:
-                    p[int(rel_sch_time/time_step):int(rel_sch_time/time_step)+len(load.power)] += np.array(load.power)
+        interval_number = int((t_end-t_start)/time_step)
+        loads = self._list_shift_loads
+
+        # Rows and starting intervals of the scheduled loads (sch_time is an absolute value in the day)
+        scheduled = [(loads.row[l_id], sch_time) for (l_id, sch_time) in schedule.items() if l_id in loads.row]
+        if len(scheduled) == 0:
+            return [0] * interval_number
+        rows = np.array([r for (r, sch_time) in scheduled])
+        start_idx = ((np.array([sch_time for (r, sch_time) in scheduled]) - t_start) / time_step).astype(int)
 
-        return p.tolist()
+        # Add all the profiles at once: one (interval, power) pair per sample of each scheduled load
+        samples = np.arange(loads.power.shape[1])
+        intervals = start_idx[:, np.newaxis] + samples[np.newaxis, :]
+        mask = (samples[np.newaxis, :] < loads.lengths[rows][:, np.newaxis]) & (intervals < interval_number)
+        p = np.bincount(intervals[mask], weights=loads.power[rows][mask], minlength=interval_number)
+
+        return p.astype(loads.power.dtype).tolist()
 
 
 # Load scheduler that takes into accout the power profiles of the other buildings/local generation
+# The gurobipy model is compiled once and kept between calls with the same time data (e.g. the rounds of a GT
+# planning phase): only the objective and the right-hand sides depending on the rest of the microgrid are updated
 class InteractiveLoadScheduler(OptiLoadScheduler):
 
+    # Names of the gurobipy status codes reported in solve_info
+    STATUS_NAMES = {GRB.OPTIMAL: "OPTIMAL", GRB.TIME_LIMIT: "TIME_LIMIT", GRB.INFEASIBLE: "INFEASIBLE",
+                    GRB.INF_OR_UNBD: "INF_OR_UNBD", GRB.INTERRUPTED: "INTERRUPTED", GRB.SUBOPTIMAL: "SUBOPTIMAL"}
+
+    def __init__(self, config_path, time_limit=None, mip_gap=None, threads=None):
+        super(InteractiveLoadScheduler, self).__init__(config_path)
+
+        # Persistent gurobipy model and the data it has been compiled for
+        self._model = None
+        self._model_data = None
+
+        # Budget of each solve: time limit [s] and relative MIP gap, None for the solver defaults
+        self._time_limit = time_limit
+        self._mip_gap = mip_gap
+
+        # Number of threads of each solve, None for the solver default (all the cores)
+        self._threads = threads
+
+        # A dict describing the last solve: 'status', 'gap', 'runtime' [s] and 'objective'
+        self.solve_info = None
+
     def schedule_loads(self, time_data, optimization_data):
         """
         This method select a starting time of the load to be scheduled, contained in self._list_shift_loads and store
@@ -228,19 +466,99 @@ class InteractiveLoadScheduler(OptiLoadScheduler):
             - 'external_consumption'
             - 'external_gen'
             - 'max_power'
-        :return: /
+        :return: a dict load_id -> starting time, the best schedule found within the time limit, or None if no feasible
+        schedule has been found. The status of the solve is stored in self.solve_info
         """
 
         # Extract the parameters for the optimization
         t_start, t_end, dt = time_data
+        elec_price, max_power, external_grid_con, remaining_gen = self.extract_optimization_data(time_data, optimization_data)
 
         # Interval number
         interval_number = int((t_end - t_start) / dt)
         # Creation of useful lists for MILP variables
         intervals = range(interval_number)
-        loads_range = range(0, len(self._list_shift_loads))
-        # List with all possible load states
-        states = [(j, i) for j in loads_range for i in intervals]
+
+        # ==============================================
+        # GUROBIPY  (needs installation of gurobi + pip install gurobipy)
+        # ==============================================
+
+        if self._model is None or self._model_data != (time_data, max_power):
+            self.build_model(time_data, max_power)
+        else:
+            logger.debug("--> Gurobi model is reused")
+
+        self.update_model(elec_price, external_grid_con, remaining_gen)
+
+        m = self._model
+        x, y, y_i_res, init_loads_weight = self._x, self._y, self._y_i_res, self._init_loads_weight
+        weight_early_load = 1  # This coefficient to ensure that sum(weight_early_load * init_loads_weight) << rest of the objective
+
+        # Solving ========================================
+        m.optimize()
+
+        self.solve_info = {'status': self.STATUS_NAMES.get(m.Status, str(m.Status)),
+                           'gap': m.MIPGap if m.SolCount > 0 and np.isfinite(m.MIPGap) else None,
+                           'runtime': m.Runtime,
+                           'objective': m.ObjVal if m.SolCount > 0 else None}
+
+        if m.SolCount == 0:
+            logger.warning("Gurobi has not found any schedule (status %s)", self.solve_info['status'])
+            return None
+
+        e_y, e_y_l, l_y, l_weight = 0, 0, 0, 0
+
+        if "energy_price" in elec_price.keys():
+            for i in intervals:
+                e_y_l += y[i].X/1000.0 * elec_price["energy_price"][i]
+
+        if "quad_price" in elec_price.keys():
+            for i in intervals:
+                e_y += y[i].X/1000.0 * y[i].X/1000.0 * elec_price["quad_price"][i]
+
+        if "local_price" in elec_price.keys():
+            for i in intervals:
+                l_y += y_i_res[i].X/1000.0 * elec_price["local_price"][i]
+
+        for i in intervals:
+            l_weight += init_loads_weight[i].X * weight_early_load
+
+        logger.debug("Guroby has solved the problem: status %s, gap %s, %s s", self.solve_info['status'], self.solve_info['gap'], self.solve_info['runtime'])
+        logger.debug(" - Total Objective function sol: %s", m.ObjVal)
+        logger.debug(" --- Objective function macrogrid quad term: %s", e_y)
+        logger.debug(" --- Objective function macrogrid lin term: %s", e_y_l)
+        logger.debug(" --- Objective function RES term: %s", l_y)
+        logger.debug(" --- Objective function init_load_weight term: %s ", l_weight)
+
+        # Manipulating the loads : scheduling
+        schedule = {}
+        for (j, i) in self._starts:
+            x_val = round(x[j, i].X)
+            if x_val == 1:
+                load_start_time = t_start + x[j, i].X * i * dt  # calculates starting time
+                load_id = self._list_shift_loads[j].id  # gets load_id
+                schedule[load_id] = load_start_time  # adds to schedule
+
+            # The solution is the starting point of the next optimization
+            x[j, i].Start = x_val
+
+        logger.debug("New schedule: %s", schedule)
+
+        return schedule
+
+    def extract_optimization_data(self, time_data, optimization_data):
+        """
+        Extract the parameters of the optimization and split the balance of the rest of the microgrid into the
+        consumption from the grid and the remaining local generation
+        :param time_data: a tuple (t_0, t_hor, t_step), as in schedule_loads()
+        :param optimization_data: a dict of data used for the optimization, as in schedule_loads()
+        :return: a tuple (elec_price, max_power, external_grid_con, remaining_gen)
+        """
+
+        t_start, t_end, dt = time_data
+
+        # Interval number
+        interval_number = int((t_end - t_start) / dt)
 
         elec_price = {}
         max_power = None
@@ -266,16 +584,80 @@ class InteractiveLoadScheduler(OptiLoadScheduler):
 
         logger.debug("Data coming from the rest of the microgrid: total demand: %s [W] | local gen: %s [W]", external_grid_con, remaining_gen)
 
-        # ==============================================
-        # GUROBIPY  (needs installation of gurobi + pip install gurobipy)
-        # ==============================================
+        return elec_price, max_power, external_grid_con, remaining_gen
+
+    def evaluate_cost(self, power, elec_price, external_grid_con, remaining_gen):
+        """
+        Evaluate the objective function of schedule_loads() for given consumption profiles of the loads, with the
+        optimal split of the consumption between the grid (y_i_m) and the remaining local generation (y_i_res)
+        :param power: the consumption of the loads at each interval: a vector, or a matrix with one profile per row
+        :param elec_price: a dictionary containing the keys: "energy_price", "quad_price", and "local_price"
+        :param external_grid_con: the consumption from the grid of the rest of the microgrid, at each interval
+        :param remaining_gen: the local generation left by the rest of the microgrid, at each interval
+        :return: the cost of each profile (a float, or a vector if power is a matrix)
+        """
+
+        power = np.asarray(power, dtype=float)
+        interval_number = power.shape[-1]
+        external_grid_con = np.asarray(external_grid_con, dtype=float)
+        remaining_gen = np.asarray(remaining_gen, dtype=float)
+
+        zeros = np.zeros(interval_number)
+        energy_price = np.asarray(elec_price.get("energy_price", zeros), dtype=float)[:interval_number]
+        local_price = np.asarray(elec_price.get("local_price", zeros), dtype=float)[:interval_number]
+        quad_price = zeros
+        if "quad_price" in elec_price.keys() and sum(external_grid_con) > 0:
+            quad_price = np.asarray(elec_price["quad_price"], dtype=float)[:interval_number]
+
+        # y_i_m lies between the consumption not covered by the local generation and the whole consumption
+        y_m_min = power - np.minimum(power, remaining_gen)
+
+        # Minimum of the cost w.r.t. y_i_m: stationary point of the quadratic, or a bound when it is linear
+        marginal_price = (energy_price - local_price) / 1000.0
+        y_m_opt = np.where(marginal_price > 0, -np.inf, np.inf)
+        has_quad = quad_price > 0
+        y_m_opt[has_quad] = (-marginal_price[has_quad] * 10.0**6 / (2 * quad_price[has_quad])) - external_grid_con[has_quad]
+        y_m = np.minimum(np.maximum(y_m_opt, y_m_min), power)
+
+        cost = (y_m/1000.0 * y_m/1000.0 + 2 * y_m/1000.0 * external_grid_con/1000.0) * quad_price
+        cost += (y_m + external_grid_con)/1000.0 * energy_price
+        cost += (power - y_m)/1000.0 * local_price
+
+        return cost.sum(axis=-1)
+
+    def build_model(self, time_data, max_power=None):
+        """
+        Compile the gurobipy model of the loads to schedule, for a given time horizon: the variables and the
+        constraints that do not depend on the rest of the microgrid.
+        The data coming from the microgrid are set with update_model()
+        :param time_data: a tuple (t_0, t_hor, t_step), as in schedule_loads()
+        :param max_power: the maximum power of the loads, or None
+        :return: /
+        """
+
+        t_start, t_end, dt = time_data
+
+        # Interval number
+        interval_number = int((t_end - t_start) / dt)
+        # Creation of useful lists for MILP variables
+        intervals = range(interval_number)
+        loads_range = range(0, len(self._list_shift_loads))
 
         # Creation of a new model
         m = Model("interactive")
+        if self._time_limit is not None:
+            m.setParam('TimeLimit', self._time_limit)
+        if self._mip_gap is not None:
+            m.setParam('MIPGap', self._mip_gap)
+        if self._threads is not None:
+            m.setParam('Threads', self._threads)
+
+        # Definition of variables ==========================
 
-        # Definition of variables and Objective ==========================
+        # Starting variables only exist inside the feasible window of each load
+        starts = [(j, i) for j in loads_range for i in self.feasible_starts(j, interval_number, dt)]
 
-        x = m.addVars(states, vtype=GRB.BINARY, name="x")  #tupledict object
+        x = m.addVars(starts, vtype=GRB.BINARY, name="x")  #tupledict object
         y = m.addVars(intervals, lb=0, vtype=GRB.CONTINUOUS, name="y")  #total consumption from grid
         y_i_m = m.addVars(intervals, lb=0, vtype=GRB.CONTINUOUS, name="y_i_m")  #individual consumption from grid
         y_i_res = m.addVars(intervals, lb=0, vtype=GRB.CONTINUOUS, name="y_i_res")  #individual consumption from RES
@@ -283,12 +665,75 @@ class InteractiveLoadScheduler(OptiLoadScheduler):
 
         m.update()
 
-        obj = 0.0
-        # Creation of a linear expression that will benefit loads that are launched first in time
+        logger.debug("--> Gurobi variables have been initialized (%s starting variables)", len(starts))
 
-        logger.debug("--> Gurobi variables have been initialized")
+        # Unique turn-on and time constraint: the windows already forbid the starts out of bound
+        for j in loads_range:
+            m.addConstr(x.sum(j, '*'), "=", 1, name='only_one_starting_time')
+
+        # Consumption of the loads at each interval, only over the feasible (load, start) pairs
+        power_coeffs = [[] for i in intervals]
+        power_vars = [[] for i in intervals]
+        init_weight_coeffs = [[] for i in intervals]
+        init_weight_vars = [[] for i in intervals]
+        profiles = [load.power.tolist() for load in self._list_shift_loads]
+        for (j, i) in starts:
+            for ia, sampled_consumption in enumerate(profiles[j]):
+                power_coeffs[i + ia].append(sampled_consumption)
+                power_vars[i + ia].append(x[j, i])
+            init_weight_coeffs[i].append(i)
+            init_weight_vars[i].append(x[j, i])
 
-        weight_early_load = 1  # This coefficient to ensure that sum(weight_early_load * init_loads_weight) << rest of the objective
+        # Max power constraint
+        if max_power != None:
+            for i in intervals:
+                m.addConstr(LinExpr(power_coeffs[i], power_vars[i]), "<=", max_power, name='max_power')
+
+        # Linear expression added to model to benefit loads scheduled earlier in time
+        for i in intervals:
+            m.addConstr(init_loads_weight[i], "=", LinExpr(init_weight_coeffs[i], init_weight_vars[i]), name='init_load_weight')
+
+        # Definition of y and y_i_res through constraints
+        local_gen_limit = []
+        macrogrid_consumption_def = []
+        for i in intervals:
+            # total individual consumption = y from grid + y from res
+            m.addConstr(LinExpr(power_coeffs[i], power_vars[i]), "=", y_i_m[i]+y_i_res[i], name='grid_demand_breakdown_def')
+            # consumption from RES smaller than remaining RES generation (RHS set by update_model)
+            local_gen_limit.append(m.addConstr(y_i_res[i], "<=", 0, name='local_gen_limit'))
+            # adding the external consumption from grid (RHS set by update_model)
+            macrogrid_consumption_def.append(m.addConstr(y_i_m[i] - y[i], "=", 0, name='macrogrid_consumption_def'))
+            # intrinsic boundaries
+            m.addConstr(y_i_res[i], ">=", 0, name='positive_local_cons')
+            m.addConstr(y_i_m[i], ">=", 0, name='positive_macrogrid_cons')
+            m.addConstr(y[i], ">=", 0, name='positive_cons')
+
+        m.setParam('OutputFlag', False)
+
+        # Keep the model and its handles
+        self._model = m
+        self._model_data = (time_data, max_power)
+        self._starts = starts
+        self._x, self._y, self._y_i_m, self._y_i_res = x, y, y_i_m, y_i_res
+        self._init_loads_weight = init_loads_weight
+        self._local_gen_limit = local_gen_limit
+        self._macrogrid_consumption_def = macrogrid_consumption_def
+
+    def update_model(self, elec_price, external_grid_con, remaining_gen):
+        """
+        Update the compiled model with the data coming from the rest of the microgrid: the objective function and
+        the right-hand sides of the constraints depending on the external consumption and generation
+        :param elec_price: a dictionary containing the keys: "energy_price", "quad_price", and "local_price"
+        :param external_grid_con: the consumption from the grid of the rest of the microgrid, at each interval
+        :param remaining_gen: the local generation left by the rest of the microgrid, at each interval
+        :return: /
+        """
+
+        m = self._model
+        y, y_i_m, y_i_res = self._y, self._y_i_m, self._y_i_res
+        intervals = range(len(self._local_gen_limit))
+
+        obj = 0.0
 
         # THE OBJECTIVE FUNCTION
         if "quad_price" in elec_price.keys() and sum(external_grid_con) > 0:
@@ -311,90 +756,269 @@ class InteractiveLoadScheduler(OptiLoadScheduler):
 
         logger.debug("--> Gurobi problem has been set (minimize e + l_res)")
 
-        # Unique turn-on constraint (did also control the out of bound. have to put other time constraints)
-        for j in loads_range:
-            sum_local = quicksum([x[j, i] for i in intervals if ((i + len(self._list_shift_loads[j].power)) <= interval_number)])
-            m.addConstr(sum_local, "=", 1, name='load_boundary')
+        for i in intervals:
+            # consumption from RES smaller than remaining RES generation
+            self._local_gen_limit[i].RHS = remaining_gen[i]
+            # y = y_i_m + external consumption from grid
+            self._macrogrid_consumption_def[i].RHS = -external_grid_con[i]
 
-        # Max power constraint
-        if max_power != None:
-            for i in intervals:
-                tmp = []
-                for j in loads_range:
-                    sampled_consumption = self._list_shift_loads[j].power
-                    tmp += [sampled_consumption[ia] * x[j, (i - ia)] for ia in range(0, len(sampled_consumption)) if ia <= i]
-                m.addConstr(quicksum(tmp), "<=", max_power, name='max_power')
+        m.update()
 
-        # Time constraint
-        for j in loads_range:
-            s = quicksum([x[j, i] for i in intervals if (self._list_shift_loads[j].st <= (i * dt) <= (self._list_shift_loads[j].et - len(self._list_shift_loads[j].power)))])
-            m.addConstr(s, "=", 1, name='only_one_starting_time')
 
-        # Linear expression added to model to benefit loads scheduled earlier in time
-        init_weight=[0] * interval_number
-        for i in intervals:
-            for j in loads_range:
-                init_weight[i] += x[j, i]*i
-            m.addConstr(init_loads_weight[i], "=", init_weight[i], name='init_load_weight')
+# Load scheduler that solves the problem of InteractiveLoadScheduler exactly, by a branch-and-bound over the combinations
+# of starting times evaluated with numpy. It is meant for buildings with a few loads, where it avoids the solver startup
+# and the model building; above max_combinations combinations, it falls back to the MILP of InteractiveLoadScheduler
+#
+# Bound: the cost of an interval is a convex function of the power of the loads, so the sum of the extra costs of each
+# load taken alone is a lower bound of the extra cost of the loads together (and is exact if they do not overlap)
+class EnumerationLoadScheduler(InteractiveLoadScheduler):
 
-        # Definition of y and y_i_res through constraints
-        for i in intervals:
-            tmp = []
-            total_m_con = []
-            for j in loads_range:
-                sampled_consumption = self._list_shift_loads[j].power
-                tmp += [sampled_consumption[ia] * x[j, (i - ia)] for ia in range(0, len(sampled_consumption)) if ia <= i]
-            # total individual consumption = y from grid + y from res
-            m.addConstr(quicksum(tmp), "=", y_i_m[i]+y_i_res[i], name='grid_demand_breakdown_def')
-            # consumption from RES smaller than remaining RES generation
-            m.addConstr(y_i_res[i], "<=", remaining_gen[i], name='local_gen_limit')
-            # adding the external consumption from grid
-            total_m_con = [y_i_m[i] + external_grid_con[i]]
-            m.addConstr(quicksum(total_m_con), "=", y[i], name='macrogrid_consumption_def')
-            # intrinsic boundaries
-            m.addConstr(y_i_res[i], ">=", 0, name='positive_local_cons')
-            m.addConstr(y_i_m[i], ">=", 0, name='positive_macrogrid_cons')
-            m.addConstr(y[i], ">=", 0, name='positive_cons')
+    MAX_COMBINATIONS = 10**6  # default maximum number of combinations of starting times
+    CHUNK_SIZE = 4096  # number of combinations evaluated at once
 
-        # Solving ========================================
-        m.update()
-        m.setParam('OutputFlag', False)
-        m.optimize()
+    def __init__(self, config_path, max_combinations=None, time_limit=None, mip_gap=None, threads=None):
+        super(EnumerationLoadScheduler, self).__init__(config_path, time_limit, mip_gap, threads)
 
-        e_y, e_y_l, l_y, l_weight = 0, 0, 0, 0
+        self._max_combinations = self.MAX_COMBINATIONS
+        if max_combinations is not None:
+            self._max_combinations = max_combinations
 
-        if "energy_price" in elec_price.keys():
-            for i in intervals:
-                e_y_l += y[i].X/1000.0 * elec_price["energy_price"][i]
+        # Power profiles of each load at each of its feasible starts, and the time data they are computed for
+        self._placements = None
+        self._placements_time_data = None
 
-        if "quad_price" in elec_price.keys():
-            for i in intervals:
-                e_y += y[i].X/1000.0 * y[i].X/1000.0 * elec_price["quad_price"][i]
+    def schedule_loads(self, time_data, optimization_data):
+        """
+        Same as InteractiveLoadScheduler.schedule_loads()
+        """
 
-        if "local_price" in elec_price.keys():
-            for i in intervals:
-                l_y += y_i_res[i].X/1000.0 * elec_price["local_price"][i]
+        # Extract the parameters for the optimization
+        t_start, t_end, dt = time_data
+        interval_number = int((t_end - t_start) / dt)
 
-        for i in intervals:
-            l_weight += init_loads_weight[i].X * weight_early_load
+        if len(self._list_shift_loads) == 0:
+            self.solve_info = {'status': "OPTIMAL", 'gap': 0.0, 'runtime': 0.0, 'objective': None}
+            return {}
+
+        solve_start = time.time()
+        if self._placements is None or self._placements_time_data != time_data:
+            self.build_placements(time_data)
+
+        starts = [s for (s, p) in self._placements]
+        nb_combinations = int(np.prod([len(s) for s in starts]))
+
+        if nb_combinations > self._max_combinations or nb_combinations == 0:
+            logger.debug("%s combinations of starting times: solving the MILP", nb_combinations)
+            return super(EnumerationLoadScheduler, self).schedule_loads(time_data, optimization_data)
+
+        elec_price, max_power, external_grid_con, remaining_gen = self.extract_optimization_data(time_data, optimization_data)
+
+        def combinations_cost(idx_starts):
+            # exact cost of the combinations given by the start indexes (one array per load)
+            power = np.zeros((len(idx_starts[0]), interval_number))
+            for (j, (s, placement)) in enumerate(self._placements):
+                power += placement[idx_starts[j]]
+            cost = self.evaluate_cost(power, elec_price, external_grid_con, remaining_gen)
+            if max_power is not None:
+                cost[power.max(axis=1) > max_power] = np.inf
+            return cost
+
+        # Extra cost of each load alone, at each of its starts
+        base_cost = self.evaluate_cost(np.zeros(interval_number), elec_price, external_grid_con, remaining_gen)
+        load_costs = [self.evaluate_cost(p, elec_price, external_grid_con, remaining_gen) - base_cost for (s, p) in self._placements]
+        remaining_min_costs = np.append(np.cumsum([c.min() for c in load_costs][::-1])[::-1], 0.0)
+
+        # First incumbent: each load at its best start
+        best_combination = np.array([np.argmin(c) for c in load_costs])
+        best_cost = combinations_cost([[idx] for idx in best_combination])[0]
+
+        # Branching: keep the partial combinations whose lower bound can still improve the incumbent
+        partial_idx = np.zeros((1, 0), dtype=int)
+        partial_bound = np.array([base_cost])
+        for (j, c) in enumerate(load_costs):
+            bound = partial_bound[:, np.newaxis] + c[np.newaxis, :] + remaining_min_costs[j + 1]
+            (idx_partial, idx_start) = np.nonzero(bound < best_cost)
+            partial_idx = np.column_stack((partial_idx[idx_partial], idx_start))
+            partial_bound = partial_bound[idx_partial] + c[idx_start]
+
+        logger.debug("%s combinations of starting times, %s left after bounding", nb_combinations, len(partial_bound))
+
+        # Evaluate the remaining combinations by increasing lower bound
+        order = np.argsort(partial_bound, kind='mergesort')
+        for first_comb in range(0, len(order), self.CHUNK_SIZE):
+            chunk = order[first_comb:first_comb + self.CHUNK_SIZE]
+            if partial_bound[chunk[0]] >= best_cost:
+                break
+
+            cost = combinations_cost(partial_idx[chunk].T)
+            k = np.argmin(cost)
+            if cost[k] < best_cost:
+                best_cost, best_combination = cost[k], partial_idx[chunk[k]]
+
+        if best_cost == np.inf:
+            logger.debug("No combination of starting times satisfies the max power: solving the MILP")
+            return super(EnumerationLoadScheduler, self).schedule_loads(time_data, optimization_data)
+
+        logger.debug(" - Total Objective function sol: %s", best_cost)
+        self.solve_info = {'status': "OPTIMAL", 'gap': 0.0, 'runtime': time.time() - solve_start, 'objective': float(best_cost)}
 
-        logger.debug("Guroby has solved the problem")
-        logger.debug(" - Total Objective function sol: %s", m.ObjVal)
-        logger.debug(" --- Objective function macrogrid quad term: %s", e_y)
-        logger.debug(" --- Objective function macrogrid lin term: %s", e_y_l)
-        logger.debug(" --- Objective function RES term: %s", l_y)
-        logger.debug(" --- Objective function init_load_weight term: %s ", l_weight)
+        # Manipulating the loads : scheduling
+        schedule = {}
+        for (j, idx_start) in enumerate(best_combination):
+            load_id = self._list_shift_loads[j].id  # gets load_id
+            schedule[load_id] = float(t_start + starts[j][idx_start] * dt)  # calculates starting time
+
+        logger.debug("New schedule: %s", schedule)
+
+        return schedule
+
+    def build_placements(self, time_data):
+        """
+        Compute, for each load, the matrix of its power profile placed at each of its feasible starts
+        :param time_data: a tuple (t_0, t_hor, t_step), as in schedule_loads()
+        :return: /
+        """
+
+        t_start, t_end, dt = time_data
+        interval_number = int((t_end - t_start) / dt)
+
+        loads = self._list_shift_loads
+        self._placements = []
+        for j in range(len(loads)):
+            starts = np.array(self.feasible_starts(j, interval_number, dt), dtype=int)
+            power = loads.power[j, :loads.lengths[j]].astype(float)
+
+            placement = np.zeros((len(starts), interval_number))
+            placement[np.arange(len(starts))[:, np.newaxis], starts[:, np.newaxis] + np.arange(len(power))] = power
+            self._placements.append((starts, placement))
+
+        self._placements_time_data = time_data
+
+
+# Load scheduler that compiles the problem of InteractiveLoadScheduler into a CompiledSchedulingProblem (sparse matrix
+# form) and solves it with a pluggable backend (see sb_problem.BACKENDS). As the gurobipy model of
+# InteractiveLoadScheduler, the compiled problem is kept between calls with the same time data
+class CompiledLoadScheduler(InteractiveLoadScheduler):
+
+    def __init__(self, config_path, backend="GUROBI", backend_options=None, time_limit=None, mip_gap=None, threads=None):
+        super(CompiledLoadScheduler, self).__init__(config_path, time_limit, mip_gap, threads)
+
+        backend_options = dict(backend_options or {})
+        backend_options.setdefault("time_limit", time_limit)
+        backend_options.setdefault("mip_gap", mip_gap)
+        backend_options.setdefault("threads", threads)
+        self._backend = get_backend(backend, backend_options)
+        self._problem = None
+
+    def schedule_loads(self, time_data, optimization_data):
+        """
+        Same as InteractiveLoadScheduler.schedule_loads()
+        """
+
+        # Extract the parameters for the optimization
+        t_start, t_end, dt = time_data
+        elec_price, max_power, external_grid_con, remaining_gen = self.extract_optimization_data(time_data, optimization_data)
+
+        if self._problem is None or self._model_data != (time_data, max_power):
+            self.compile_problem(time_data, max_power)
+
+        self._problem.set_data(elec_price, external_grid_con, remaining_gen)
+
+        # Solving ========================================
+        solution = self._backend.solve(self._problem)
+        self.solve_info = dict(self._backend.info)
+
+        if solution is None:
+            self.solve_info['objective'] = None
+            logger.warning("%s has not found any schedule (status %s)", type(self._backend).__name__, self.solve_info['status'])
+            return None
+
+        self.solve_info['objective'] = float(self._problem.objective(solution))
+        logger.debug("%s has solved the problem: status %s, gap %s, %s s", type(self._backend).__name__, self.solve_info['status'], self.solve_info['gap'], self.solve_info['runtime'])
+        logger.debug(" - Total Objective function sol: %s", self.solve_info['objective'])
 
         # Manipulating the loads : scheduling
         schedule = {}
-        for j in loads_range:
-            for i in intervals:
-                x_val = round(x[j, i].X)
-                if x_val == 1:
-                    load_start_time = t_start + x[j, i].X * i * dt  # calculates starting time
-                    load_id = self._list_shift_loads[j].id  # gets load_id
-                    schedule[load_id] = load_start_time  # adds to schedule
+        for (j, i) in self._problem.starts_from_solution(solution):
+            load_id = self._list_shift_loads[j].id  # gets load_id
+            schedule[load_id] = float(t_start + i * dt)  # calculates starting time
 
         logger.debug("New schedule: %s", schedule)
 
         return schedule
+
+    def compile_problem(self, time_data, max_power=None):
+        """
+        Compile the structure of the problem for a given time horizon
+        :param time_data: a tuple (t_0, t_hor, t_step), as in schedule_loads()
+        :param max_power: the maximum power of the loads, or None
+        :return: /
+        """
+
+        t_start, t_end, dt = time_data
+        interval_number = int((t_end - t_start) / dt)
+
+        starts = [self.feasible_starts(j, interval_number, dt) for j in range(len(self._list_shift_loads))]
+        self._problem = CompiledSchedulingProblem([l.power for l in self._list_shift_loads], starts, interval_number, max_power)
+        self._model_data = (time_data, max_power)
+
+        logger.debug("--> Problem compiled: %s variables, %s non-zeros", self._problem.nb_vars, self._problem.a_eq.nnz + self._problem.a_ub.nnz)
+
+
+# Bounded LRU cache of the solutions of the scheduling problem
+# A building that is asked to re-optimize with exactly the same data as one of its previous rounds gets the stored
+# schedule back, without running the solver
+class ScheduleCache(object):
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(time_data, optimization_data, loads):
+        """
+        :param time_data: a tuple (t_0, t_hor, t_step), as in schedule_loads()
+        :param optimization_data: a dict of data used for the optimization, as in schedule_loads()
+        :param loads: the list of Load objects that remain to schedule
+        :return: a digest of all the data that define the scheduling problem
+        """
+        h = hashlib.sha1(repr(tuple(time_data)))
+        h.update(repr([(l.id, l.st, l.et) for l in loads]))
+
+        for (name, data) in sorted(optimization_data.items()):
+            h.update(name)
+            if type(data) is dict:
+                for (k, v) in sorted(data.items()):
+                    h.update(k)
+                    h.update(np.ascontiguousarray(v, dtype=float).tostring())
+            elif data is not None:
+                h.update(np.ascontiguousarray(data, dtype=float).tostring())
+
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        :return: the tuple (schedule, power vector) stored for this key, or None
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        value = self._entries.pop(key)
+        self._entries[key] = value
+        return value
+
+    def put(self, key, schedule, power):
+        if self._max_size <= 0:
+            return
+
+        self._entries.pop(key, None)
+        self._entries[key] = (schedule, power)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
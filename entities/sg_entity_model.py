@@ -2,12 +2,14 @@ __author__ = 'Olivier Van Cutsem'
 
 import os, inspect
 from abc import abstractmethod
-import pandas as pd
 import logging
 from sg_entity_param import *
 import numpy as np
-from sb_scheduler import OptiLoadScheduler, InteractiveLoadScheduler
-from fault_management import FaultForecast
+from sb_scheduler import OptiLoadScheduler, InteractiveLoadScheduler, EnumerationLoadScheduler, CompiledLoadScheduler, ScheduleCache
+from fault_management import FaultForecast, FaultSchedule, apply_faults
+from price_table import PriceTable
+from time_series_store import TimeSeriesStore
+from sg_wire import TimeRange
 import json
 #
 ### Generic model of a Smart Grid Entity
@@ -36,12 +38,51 @@ class SmartGridEntityModel(object):
         self.param = simu_param
 
         # Fault management
-        self.list_faults = []
-        self.current_fault = None
+        self.faults = FaultSchedule()
+
+        # Noise of the real-time phase: a stream per entity, seeded from the simulation seed and the entity ID, drawn
+        # one day at a time
+        self.noise_rng = np.random.RandomState(None if SIMULATION_SEED is None else [SIMULATION_SEED, int(ent_id)])
+        self.__noise_day = None
+        self.__daily_noise = None
 
     def update_time(self):
         self.current_time += self.dt
 
+    def rt_noise(self):
+        """
+        :return: the standard normal noise of the current time step
+        """
+        return self.rt_noise_range(1)[0]
+
+    def rt_noise_range(self, n_steps):
+        """
+        :param n_steps: the number of time steps, from the current one
+        :return: the standard normal noise of these steps, the same values as rt_noise() at each of these steps
+        """
+        steps_per_day = int(24 * 3600 / self.dt)
+        step = int(self.current_time / self.dt)
+        noise = np.empty(n_steps)
+
+        k = 0
+        while k < n_steps:
+            day, idx = divmod(step + k, steps_per_day)
+            if day != self.__noise_day:
+                self.__daily_noise = self.noise_rng.standard_normal(steps_per_day)
+                self.__noise_day = day
+
+            n = min(steps_per_day - idx, n_steps - k)
+            noise[k:k + n] = self.__daily_noise[idx:idx + n]
+            k += n
+
+        return noise
+
+    def time_steps(self, t0, n_steps):
+        """
+        :return: the times t0, t0 + dt, ... of n_steps time steps, as a numpy array
+        """
+        return t0 + self.dt * np.arange(n_steps)
+
     @abstractmethod
     def rt_phase(self, payload_msg):
         """
@@ -51,6 +92,19 @@ class SmartGridEntityModel(object):
         """
         pass
 
+    @abstractmethod
+    def rt_phase_range(self, t0, n_steps):
+        """
+        Real-time phase of several consecutive time steps, from t0: the same values as rt_phase() followed by
+        update_time() at each step. The evaluation stops after the first step that requests a planning phase.
+        The current time is then the time step following the last evaluated step.
+        :param t0: the time of the first step
+        :param n_steps: the maximum number of steps to evaluate
+        :return: a dictionary with the "timestamps" of the evaluated steps (a TimeRange) and, for each data key of
+        rt_phase(), a numpy array of the values at these steps
+        """
+        pass
+
     @abstractmethod
     def planning_phase(self, payload_msg):
         """
@@ -77,12 +131,12 @@ class MicroGridManagerEntityModel(SmartGridEntityModel):
     def __init__(self, ent_id, time_data, simu_param=None):
         super(MicroGridManagerEntityModel, self).__init__(ent_id, time_data, simu_param)
 
-        # Read DR config file
-        self.dr_simu_data = None
+        # Read the energy price of the DR config file
+        self.energy_price = None
         try:
-            self.dr_simu_data = json.load(open("{}/{}{}.json".format(cmd_folder, self.DR_CONFIG_FOLDER, SIMULATION_TYPE_DR)))
+            self.energy_price = TimeSeriesStore.get("{}/{}{}.json".format(cmd_folder, self.DR_CONFIG_FOLDER, SIMULATION_TYPE_DR), "energy_price")
         except:
-            print("WARNING: MGM cannot open DR simu config file")
+            print("WARNING: MGM cannot read the energy price of the DR simu config file")
 
     def rt_phase(self, payload_msg):
         """
@@ -92,10 +146,21 @@ class MicroGridManagerEntityModel(SmartGridEntityModel):
         :param payload_msg: a dictionary sent by the simu coord
         :return:
         """
-        idx_vector = int((self.current_time % (24 * 3600)) / ((24 * 3600)/len(self.dr_simu_data["energy_price"])))
-        current_price_value = self.dr_simu_data["energy_price"][idx_vector]  # Online works with 1h data !
+        current_price_value = float(self.energy_price.value_at(self.current_time))
         return {ZMQ_RT_DATA_PRICE: current_price_value}
 
+    def rt_phase_range(self, t0, n_steps):
+        """
+        The real-time prices of n_steps time steps from t0
+        :param t0: the time of the first step
+        :param n_steps: the number of steps
+        :return: see SmartGridEntityModel.rt_phase_range
+        """
+        prices = np.asarray(self.energy_price.window(t0, t0 + n_steps * self.dt, self.dt), dtype=float)
+        self.current_time = t0 + n_steps * self.dt
+
+        return {"timestamps": TimeRange(t0, t0 + n_steps * self.dt, self.dt), ZMQ_RT_DATA_PRICE: prices}
+
     def planning_phase(self, payload_msg):
         """
         Day Ahead logic. Depending on the DR config, various logic are possible
@@ -105,8 +170,9 @@ class MicroGridManagerEntityModel(SmartGridEntityModel):
         nb_steps = int(24 * 3600 / self.dt)
         ret = {}
         type_msg = payload_msg[ZMQ_PLANNING_PAYLOAD_TYPE_SIG_KEY]
-        price_sig = resample_price_sig(self.dr_simu_data["energy_price"], 0, (0, 24 * 3600, self.dt))
-        ret[ZMQ_PLANNING_PAYLOAD_TYPE_PRICE] = {"timestamps": range(0, 24*3600, self.dt), "forecast_data": list(price_sig)}
+        day_start = self.current_time - self.current_time % (24*3600)
+        price_sig = PriceTable.get(self.energy_price.window(day_start, day_start + 24*3600), self.dt).values
+        ret[ZMQ_PLANNING_PAYLOAD_TYPE_PRICE] = {"timestamps": TimeRange(0, 24*3600, self.dt), "forecast_data": price_sig}
 
         # TEST:
         # Only one round: receiving START -> send prices -> receive DATA -> send END
@@ -124,9 +190,10 @@ class DistributedEnergyResourceEntityModel(SmartGridEntityModel):
     def __init__(self, ent_id, time_data, simu_param=None):
         super(DistributedEnergyResourceEntityModel, self).__init__(ent_id, time_data, simu_param)
 
-        # Loading data from Pandas DF
+        # Time series of the time series store
         self.forecast_data = None
         self.production_data = None
+        self.noise_scale = None  # standard deviation of the real-time noise
         self.init_data()
 
         # Faults list init
@@ -141,10 +208,9 @@ class DistributedEnergyResourceEntityModel(SmartGridEntityModel):
         try:
             filename = map_data["DER"][str(self.id)]
 
-            df = pd.read_csv(cmd_folder+"/"+filename)
-
-            self.forecast_data = list(df["forecast"].values)
-            self.production_data = list(df["production"].values)
+            self.forecast_data = TimeSeriesStore.get(cmd_folder+"/"+filename, "forecast")
+            self.production_data = TimeSeriesStore.get(cmd_folder+"/"+filename, "production")
+            self.noise_scale = self.production_data.values.max()/10.0
 
         except:
             print("WARNING: DER #{} does not have data to read".format(self.id))
@@ -163,7 +229,7 @@ class DistributedEnergyResourceEntityModel(SmartGridEntityModel):
             e_t = data[fault_id]['data'][1]
             coef = data[fault_id]['data'][2]
             t_trigger = data[fault_id]['t_trigger']
-            self.list_faults.append({"t_trigger": t_trigger, "data": FaultForecast(s_t, e_t, coef)})
+            self.faults.add(t_trigger, FaultForecast(s_t, e_t, coef))
 
     def rt_phase(self, payload_msg):
         """
@@ -172,12 +238,9 @@ class DistributedEnergyResourceEntityModel(SmartGridEntityModel):
         :return:
         """
 
-        # get the hour in the day
-        hour_in_day = int((self.current_time / self.dt)) % (24 * int(3600/self.dt))
-        p_gen = self.production_data[hour_in_day]
+        p_gen = self.production_data.value_at(self.current_time)
 
-        np.random.seed()
-        p_noise = np.random.normal(0, max(self.production_data)/10.0)
+        p_noise = self.noise_scale * self.rt_noise()
 
         ret_msg = {ZMQ_RT_DATA_GENERATION: max(p_gen + p_noise, 0)}
 
@@ -187,6 +250,37 @@ class DistributedEnergyResourceEntityModel(SmartGridEntityModel):
 
         return ret_msg
 
+    def rt_phase_range(self, t0, n_steps):
+        """
+        The real-time generation of at most n_steps time steps from t0. The block ends at the step where the next fault
+        is triggered, which requests a planning phase.
+        :param t0: the time of the first step
+        :param n_steps: the maximum number of steps
+        :return: see SmartGridEntityModel.rt_phase_range
+        """
+        self.current_time = t0
+        times = self.time_steps(t0, n_steps)
+
+        # Only the first triggered fault can stop the block: the faults are updated once, at its last step
+        t_trigger = self.faults.next_trigger
+        if t_trigger is not None and n_steps > 0 and times[-1] >= t_trigger:
+            n_steps = int(np.argmax(times >= t_trigger)) + 1
+            times = times[:n_steps]
+
+        p_gen = np.asarray(self.production_data.window(t0, t0 + n_steps * self.dt, self.dt), dtype=float)
+        p_noise = self.noise_scale * self.rt_noise_range(n_steps)
+
+        ret_msg = {"timestamps": TimeRange(t0, t0 + n_steps * self.dt, self.dt),
+                   ZMQ_RT_DATA_GENERATION: np.maximum(p_gen + p_noise, 0)}
+
+        if n_steps > 0 and self.faults.update(times[-1]) is True:
+            logger.debug("DER #{} is requesting a Planning Phase @ t={}".format(self.id, times[-1]))
+            ret_msg[ZMQ_RT_DATA_PLANNING_REQUEST] = True
+
+        self.current_time = t0 + n_steps * self.dt
+
+        return ret_msg
+
     def planning_phase(self, payload_msg):
         """
         Describe TODO
@@ -199,9 +293,11 @@ class DistributedEnergyResourceEntityModel(SmartGridEntityModel):
         # generate the time and data vector
         t_0 = self.current_time % (24*3600)
         t_end = 24*3600
-        sig_data = generate_forecast(self.forecast_data, (t_0, t_end, self.dt), self.current_fault)
+        day_start = self.current_time - t_0
+        day_forecast = self.forecast_data.window(day_start, day_start + t_end, self.dt)
+        sig_data = generate_forecast(day_forecast, (t_0, t_end, self.dt), self.faults.active_faults)
 
-        ret[ZMQ_PLANNING_PAYLOAD_TYPE_GEN] = {"timestamps": range(t_0, t_end, self.dt), "forecast_data": sig_data}
+        ret[ZMQ_PLANNING_PAYLOAD_TYPE_GEN] = {"timestamps": TimeRange(t_0, t_end, self.dt), "forecast_data": np.asarray(sig_data, dtype=float)}
 
         if SIMULATION_ARCH_CENTRALIZED:
             if type_msg == ZMQ_PLANNING_TYPE_SIG_START:
@@ -220,29 +316,19 @@ class DistributedEnergyResourceEntityModel(SmartGridEntityModel):
 
     def update_current_fault(self):
         """
-        This method compares the current time with the triggering time of the faults.
-        In case of a new fault to trigger, it stores it in 'self.current_fault' and return True. Otherwise it returns False
+        This method compares the current time with the triggering and ending times of the faults.
+        The new faults to trigger become active, the faults that reached their ending time are removed.
         :return: boolean if a new fault is triggered
         """
-
-        # New fault to trigger
-        if len(self.list_faults) > 0:
-            # Did we reach the time to trigger the new fault ?
-            if self.current_time >= self.list_faults[0]["t_trigger"]:
-                self.current_fault = self.list_faults.pop(0)["data"]  # remove and store the current fault
-                return True
-
-        # Is there a current fault to end?
-        if self.current_fault is not None and self.current_time >= self.current_fault.ending_time:
-            self.current_fault = None
-
-        return False
+        return self.faults.update(self.current_time)
 
 
 # ----------- The Smart-Building
 
 class SmartBuildingEntityModel(SmartGridEntityModel):
 
+    AGGREGATE_CHECK_PERIOD = 50  # rounds between two full recomputations of the external consumption and generation
+
     def __init__(self, ent_id, time_data, simu_param=None):
         super(SmartBuildingEntityModel, self).__init__(ent_id, time_data, simu_param)
 
@@ -253,6 +339,29 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
         # State used this GT phase
         self.pp_state = dict()
 
+        # Scheduler kept for the whole GT phase: its model is compiled once and updated at each round
+        self.__scheduler = None
+
+        # Solutions of the previous rounds, to skip the solver when the data of a round has already been seen
+        self.__schedule_cache = ScheduleCache(SCHEDULER_CACHE_SIZE)
+
+        # Status, gap and runtime of the last solve, reported to the coordinator
+        self.__solve_info = None
+
+        # A tuple (forecast, standard deviation of the real-time noise for this forecast)
+        self.__noise_scale = None
+
+        # Random draws of the JACOBI planning: does this SB apply its new best response at this round ?
+        self.__planning_rng = np.random.RandomState(None if SIMULATION_SEED is None else SIMULATION_SEED + int(ent_id))
+
+    @property
+    def schedule_cache_hits(self):
+        return self.__schedule_cache.hits
+
+    @property
+    def schedule_cache_misses(self):
+        return self.__schedule_cache.misses
+
     def rt_phase(self, payload_msg):
         """
         Describe TODO
@@ -260,12 +369,37 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
         :return:
         """
         hour_in_day = int(self.current_time / self.dt) % (24 * int(3600/self.dt))
-        p = self.__energy_planning['forecast_data'][hour_in_day]
+        forecast = self.__energy_planning['forecast_data']
+        p = forecast[hour_in_day]
+
+        # The scale of the noise is computed once per planning
+        if self.__noise_scale is None or self.__noise_scale[0] is not forecast:
+            self.__noise_scale = (forecast, max(forecast)/10.0)
 
-        np.random.seed()
-        p_noise = np.random.normal(0, max(self.__energy_planning['forecast_data'])/10.0)
+        p_noise = self.__noise_scale[1] * self.rt_noise()
         return {ZMQ_RT_DATA_CONSUMPTION: max(p + p_noise, 0)}
 
+    def rt_phase_range(self, t0, n_steps):
+        """
+        The real-time consumption of n_steps time steps from t0, following the current planning. A SB never requests
+        a planning phase in real-time.
+        :param t0: the time of the first step
+        :param n_steps: the number of steps
+        :return: see SmartGridEntityModel.rt_phase_range
+        """
+        self.current_time = t0
+        steps_per_day = 24 * int(3600/self.dt)
+        forecast = self.__energy_planning['forecast_data']
+        p = np.asarray(forecast, dtype=float)[(self.time_steps(t0, n_steps) / self.dt).astype(int) % steps_per_day]
+
+        if self.__noise_scale is None or self.__noise_scale[0] is not forecast:
+            self.__noise_scale = (forecast, max(forecast)/10.0)
+
+        p_noise = self.__noise_scale[1] * self.rt_noise_range(n_steps)
+        self.current_time = t0 + n_steps * self.dt
+
+        return {"timestamps": TimeRange(t0, t0 + n_steps * self.dt, self.dt), ZMQ_RT_DATA_CONSUMPTION: np.maximum(p + p_noise, 0)}
+
     def planning_phase(self, payload_msg):
         """
         Centralized of Decentralized
@@ -301,6 +435,7 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
             # Updates energy plannings (solve opti problem)
             self.update_energy_planning()
             ret[ZMQ_PLANNING_PAYLOAD_TYPE_CONS] = self.__energy_planning
+            ret[ZMQ_PLANNING_PAYLOAD_TYPE_SOLVE_INFO] = self.__solve_info
 
         elif type_msg == ZMQ_PLANNING_TYPE_SIG_END:
             ret[ZMQ_PLANNING_PAYLOAD_TYPE_SIG_KEY] = ZMQ_PLANNING_TYPE_SIG_END
@@ -387,10 +522,23 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
 
         # Internal data
         self.pp_state["ext_consumption_forecast"] = {}  # a map ID_sb -> FORECAST
+        self.pp_state["ext_forecast_versions"] = {}  # a map ID_sb -> version of its FORECAST
+        self.pp_state["resync"] = []  # the SBs whose stored FORECAST is out of date: their whole forecast is requested
+
+        # Versions of the forecast of this SB: the updates only carry the runs that changed since the previous version
+        self.pp_state["forecast_version"] = -1
+        self.pp_state["sent_forecast"] = None
+
+        # Running totals of the forecasts of the rest of the microgrid, updated building by building
+        self.pp_state["ext_consumption"], self.pp_state["ext_generation"] = self.compute_external_aggregates(int((t_end - t_0) / self.dt))
+        self.pp_state["aggregate_rounds"] = 0
 
         if SIMULATION_USE_BLOCKCHAIN:
             self.pp_state["bc_info"] = {}
 
+        # New phase: the loads to schedule and the time window have changed
+        self.__scheduler = None
+
         ret = {ZMQ_PLANNING_PAYLOAD_TYPE_SIG_KEY: ZMQ_PLANNING_TYPE_SIG_START}
 
         # Give a first consumption
@@ -398,8 +546,10 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
         sig_data = self.__energy_planning['forecast_data'][idx_start:idx_end]
 
         # Generate the message to send back
-        data_cons_forecast = {"timestamps": range(t_0, t_end, self.dt), "forecast_data": sig_data}
+        data_cons_forecast = {"timestamps": TimeRange(t_0, t_end, self.dt)}
+        data_cons_forecast.update(self.forecast_update(sig_data, full=True))
         ret[ZMQ_PLANNING_PAYLOAD_TYPE_CONS] = data_cons_forecast
+        ret[ZMQ_PLANNING_PAYLOAD_TYPE_SOLVE_INFO] = self.__solve_info
 
         return ret
 
@@ -411,6 +561,8 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
         """
 
         ret = {ZMQ_PLANNING_PAYLOAD_TYPE_SIG_KEY: ZMQ_PLANNING_TYPE_SIG_END}
+        self.__scheduler = None
+        logger.info("SB %s schedule cache: %s hits, %s misses", self.id, self.__schedule_cache.hits, self.__schedule_cache.misses)
         logger.debug("SB %s size of optimal power: %s. Optimal power vector: %s", self.id, len(self.__energy_planning['forecast_data']), self.__energy_planning)
         return ret
 
@@ -428,11 +580,22 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
         t_end = 24*3600
         idx_start = t_0/self.dt
         idx_end = t_end/self.dt
-        data_cons_forecast = {"timestamps": range(t_0, t_end, self.dt), "forecast_data": None}
+        data_cons_forecast = {"timestamps": TimeRange(t_0, t_end, self.dt), "forecast_data": None}
 
-        # Analysis of data_msg:
+        # Analysis of data_msg: only the forecasts that have changed modify the aggregates
         for sb_id, data_sb in data_msg[ZMQ_PLANNING_PAYLOAD_TYPE_CONS].items():
-            self.pp_state["ext_consumption_forecast"][sb_id] = data_sb["forecast_data"]
+            self.receive_forecast_update(sb_id, data_sb)
+
+        if len(self.pp_state["resync"]) > 0:
+            ret[ZMQ_PLANNING_PAYLOAD_TYPE_RESYNC] = self.pp_state["resync"]
+            self.pp_state["resync"] = []
+
+        # The coordinator may have lost my last update: send the whole forecast
+        resync_requested = int(self.id) in [int(i) for i in data_msg.get(ZMQ_PLANNING_PAYLOAD_TYPE_RESYNC, [])]
+
+        self.pp_state["aggregate_rounds"] += 1
+        if self.pp_state["aggregate_rounds"] % self.AGGREGATE_CHECK_PERIOD == 0:
+            self.check_external_aggregates()
 
         # Do the local optimization
 
@@ -441,15 +604,51 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
 
         # gets the current energy planning
         former_state = self.__energy_planning.get('forecast_data', None)
+        former_schedule = dict(self.__load_schedule)
         logger.debug("Its current planning: %s", former_state)
 
         # updates energy plannings (solve opti problem)
-        self.update_energy_planning()
-
-        if not (self.__energy_planning['forecast_data'] == former_state):  # if sb has modified his forecasted data
+        time_data, data_opti = self.update_energy_planning()
+        ret[ZMQ_PLANNING_PAYLOAD_TYPE_SOLVE_INFO] = self.__solve_info
+
+        # Convergence: distance to the former planning and gain of cost, against the same state of the microgrid
+        changed = True
+        if former_state is not None:
+            former_sig = former_state[idx_start:idx_end]
+            new_sig = self.__energy_planning['forecast_data'][idx_start:idx_end]
+            residual = forecast_norm(np.subtract(new_sig, former_sig))
+            cost_delta = None
+            former_cost = self.planning_cost(time_data, data_opti, former_sig)
+            if former_cost is not None:
+                cost_delta = self.planning_cost(time_data, data_opti, new_sig) - former_cost
+            ret[ZMQ_PLANNING_PAYLOAD_TYPE_RESIDUAL] = residual
+            ret[ZMQ_PLANNING_PAYLOAD_TYPE_COST_DELTA] = cost_delta
+
+            changed = not within_tolerance(residual, forecast_norm(former_sig), cost_delta)
+            if not changed and residual > 0:
+                # Within tolerance: keep the planning the other buildings know
+                logger.debug("SB%s: new planning within tolerance (residual %s, cost delta %s), it is not applied", self.id, residual, cost_delta)
+                self.__energy_planning['forecast_data'] = former_state
+                self.__load_schedule = former_schedule
+
+        # JACOBI: all the SBs answer to the same snapshot, only a random subset of them moves to limit oscillations
+        if SIMULATION_PLANNING_UPDATE_MODE == SIMULATION_PLANNING_UPDATE_JACOBI and former_state is not None and changed \
+                and self.__planning_rng.rand() >= SIMULATION_PLANNING_UPDATE_PROB:
+            logger.debug("SB%s keeps its planning for this round", self.id)
+            self.__energy_planning['forecast_data'] = former_state
+            self.__load_schedule = former_schedule
+
+            # Not converged: send the unchanged planning (no run), so that the coordinator keeps on iterating
+            data_cons_forecast.update(self.forecast_update(former_state[idx_start:idx_end], full=resync_requested))
+            ret[ZMQ_PLANNING_PAYLOAD_TYPE_CONS] = data_cons_forecast
+            return ret
+
+        if changed:  # if sb has modified his forecasted data
             # broadcast the change to the blockchain
-            data_cons_forecast["forecast_data"] = self.__energy_planning['forecast_data'][idx_start:idx_end]
+            data_cons_forecast.update(self.forecast_update(self.__energy_planning['forecast_data'][idx_start:idx_end], full=resync_requested))
             logger.debug("Forecast modified: %s", self.__energy_planning['forecast_data'])
+        elif resync_requested:
+            data_cons_forecast.update(self.forecast_update(self.__energy_planning['forecast_data'][idx_start:idx_end], full=True))
         else:
             logger.debug('The planning of SB%s has not changed !', self.id)
 
@@ -460,7 +659,28 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
     def update_energy_planning(self):
         """
         Solve the LP opti that produce the planning for the day. Store it into EnergyPlanning
-        :return: /
+        :return: a tuple (time_data, data_opti), the data of the problem that has been solved
+        """
+
+        time_data, data_opti = self.prepare_energy_planning()
+
+        if not SIMULATION_ARCH_CENTRALIZED:
+            # The scheduler is created at the first round of the GT phase and then reused
+            if self.__scheduler is None:
+                self.__scheduler = self.create_scheduler(time_data)
+            opti_scheduler = self.__scheduler
+        else:  # CENTRALIZED MODE
+            opti_scheduler = self.create_scheduler(time_data)
+
+        en_sched, opti_power = self.solve_schedule(opti_scheduler, time_data, data_opti)
+        self.apply_energy_planning(time_data, en_sched, opti_power)
+
+        return time_data, data_opti
+
+    def prepare_energy_planning(self):
+        """
+        Gather the data of the scheduling problem of the day, from the current time
+        :return: a tuple (time_data, data_opti), the parameters of the scheduler schedule_loads() method
         """
 
         # Optimization parameters: TODO remove it
@@ -482,50 +702,245 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
         price_sig = None
         if type(self.pp_state["electricity_price"]) is not dict:
             price_sig = resample_price_sig(self.pp_state["electricity_price"], 0, time_data)  # the second parameter means that the price info is directly a vecotr
+        elif SIMULATION_ARCH_CENTRALIZED:
+            # The MGM price {"timestamps", "forecast_data"} is forwarded as is: only its values are resampled
+            price_sig = {"forecast_data": resample_price_sig(self.pp_state["electricity_price"]["forecast_data"], 0, time_data)}
         else:
             price_sig = {}
             for k, v in self.pp_state["electricity_price"].items():
                 price_sig[k] = resample_price_sig(v, 0, time_data)
 
-        # In decentralized mode, the other buildings and DERs send their forecast
+        # In decentralized mode, the other buildings and DERs send their forecast: their totals are kept up to date
+        # by run_gt_logic()
         if not SIMULATION_ARCH_CENTRALIZED:
-            pred_cons = self.pp_state["ext_consumption_forecast"]
-            pred_gens = self.pp_state["ext_generation_forecast"]
-
-            # Computing the total external power at each interval
-            external_generation = [0] * int((t_end - current_time) / self.dt)
-            external_consumption = [0] * int((t_end - current_time) / self.dt)
-            for (sb_id, forecast_profile) in pred_cons.iteritems():
-                if int(sb_id) != int(self.id):
-                    if type(forecast_profile) is list and len(forecast_profile) == len(external_generation):
-                        external_consumption = [x + max(y_sb, 0) for (x, y_sb) in zip(external_consumption, forecast_profile)]
-                        external_generation = [x - min(y_sb, 0) for (x, y_sb) in zip(external_generation, forecast_profile)]  # y_sb is negative
-
-            # Computing total generation of sum of RES and SBs that produce
-            if pred_gens is not None:
-                for der_id, der_data in pred_gens.items():
-                    external_generation = [x + y_der for (x, y_der) in zip(external_generation, der_data)]  # y_der is positive
-
-            # Launch the scheduling
+            external_consumption = self.pp_state["ext_consumption"].copy()
+            external_generation = self.pp_state["ext_generation"].copy()
+
             data_opti = {'price_elec': price_sig, 'external_consumption': external_consumption, 'external_gen': external_generation}
-            interactive_scheduler = InteractiveLoadScheduler(self.CONFIG_FILENAME)
-            interactive_scheduler.init_loads(self.id, time_data, self.__load_schedule)
-            en_sched = interactive_scheduler.schedule_loads(time_data, data_opti)
-            opti_power = interactive_scheduler.schedule_power_vector(en_sched, time_data)
 
         else:  # CENTRALIZED MODE
-            opti_scheduler = InteractiveLoadScheduler(self.CONFIG_FILENAME)
-            opti_scheduler.init_loads(self.id, time_data, self.__load_schedule)
             # price_sig is sent by the MGM: take the "forecast_data
             # TODO: allow demand cost ? bof bof pour residential ..
             data_opti = {'price_elec': {'energy_price': price_sig["forecast_data"]}}
-            en_sched = opti_scheduler.schedule_loads(time_data, data_opti)
-            opti_power = opti_scheduler.schedule_power_vector(en_sched, time_data)
+
+        return time_data, data_opti
+
+    def planning_cost(self, time_data, data_opti, forecast):
+        """
+        :param time_data: a tuple (t_start, t_end, dt)
+        :param data_opti: the optimization data given to the scheduler
+        :param forecast: a power vector of the loads, from t_start
+        :return: the cost of this power vector for the objective of the scheduler, None if it cannot be evaluated
+        """
+        if self.__scheduler is None or not isinstance(data_opti.get('price_elec'), dict):
+            return None
+
+        elec_price, max_power, external_grid_con, remaining_gen = self.__scheduler.extract_optimization_data(time_data, data_opti)
+        return float(self.__scheduler.evaluate_cost(forecast, elec_price, external_grid_con, remaining_gen))
+
+    def forecast_contribution(self, sb_id, forecast_profile, nb_steps):
+        """
+        :param sb_id: the ID of the building that sent the forecast
+        :param forecast_profile: its forecast (a list or a numpy array, negative when the building produces)
+        :param nb_steps: the length of the planning horizon
+        :return: a tuple (consumption, generation) of numpy arrays, or None if the forecast does not count
+        """
+        if int(sb_id) == int(self.id) or not isinstance(forecast_profile, (list, np.ndarray)) or len(forecast_profile) != nb_steps:
+            return None
+
+        forecast_profile = np.asarray(forecast_profile, dtype=float)
+        return forecast_profile.clip(min=0), (-forecast_profile).clip(min=0)  # y_sb is negative when it produces
+
+    def compute_external_aggregates(self, nb_steps):
+        """
+        Full computation of the total consumption and generation of the rest of the microgrid
+        :param nb_steps: the length of the planning horizon
+        :return: a tuple (consumption, generation) of numpy arrays
+        """
+        external_consumption = np.zeros(nb_steps)
+        external_generation = np.zeros(nb_steps)
+
+        for (sb_id, forecast_profile) in self.pp_state["ext_consumption_forecast"].iteritems():
+            contribution = self.forecast_contribution(sb_id, forecast_profile, nb_steps)
+            if contribution is not None:
+                external_consumption += contribution[0]
+                external_generation += contribution[1]
+
+        # Computing total generation of sum of RES and SBs that produce
+        pred_gens = self.pp_state["ext_generation_forecast"]
+        if pred_gens is not None:
+            for der_id, der_data in pred_gens.items():
+                n = min(len(der_data), nb_steps)
+                external_generation[:n] += np.asarray(der_data[:n], dtype=float)  # y_der is positive
+
+        return external_consumption, external_generation
+
+    def update_external_forecast(self, sb_id, forecast_profile):
+        """
+        Store the new forecast of a building and replace its old contribution in the running totals
+        """
+        former_profile = self.pp_state["ext_consumption_forecast"].get(sb_id, None)
+        self.pp_state["ext_consumption_forecast"][sb_id] = forecast_profile
+        if same_forecast(forecast_profile, former_profile):
+            return
+
+        nb_steps = len(self.pp_state["ext_consumption"])
+        former_contribution = self.forecast_contribution(sb_id, former_profile, nb_steps)
+        if former_contribution is not None:
+            self.pp_state["ext_consumption"] -= former_contribution[0]
+            self.pp_state["ext_generation"] -= former_contribution[1]
+
+        contribution = self.forecast_contribution(sb_id, forecast_profile, nb_steps)
+        if contribution is not None:
+            self.pp_state["ext_consumption"] += contribution[0]
+            self.pp_state["ext_generation"] += contribution[1]
+
+    def receive_forecast_update(self, sb_id, data_sb):
+        """
+        Apply the forecast of another building received from the coordinator: a whole forecast, the runs that changed
+        since the version stored here, or nothing if it has not changed. A version gap triggers a resync request.
+        """
+        if data_sb.get("forecast_data") is not None:
+            self.update_external_forecast(sb_id, np.array(data_sb["forecast_data"], dtype=float))  # patched in place later
+            self.pp_state["ext_forecast_versions"][sb_id] = data_sb.get("version")
+
+        elif "runs" in data_sb:
+            if sb_id not in self.pp_state["ext_consumption_forecast"] or self.pp_state["ext_forecast_versions"].get(sb_id) != data_sb["base_version"]:
+                logger.warning("SB%s has missed an update of the forecast of SB%s: it requests the whole forecast", self.id, sb_id)
+                if int(sb_id) not in self.pp_state["resync"]:
+                    self.pp_state["resync"].append(int(sb_id))
+                return
+
+            self.patch_external_forecast(sb_id, data_sb["runs"])
+            self.pp_state["ext_forecast_versions"][sb_id] = data_sb["version"]
+
+    def patch_external_forecast(self, sb_id, runs):
+        """
+        Patch in place the stored forecast of a building and its contribution to the running totals
+        :param runs: a list of [start index, new values]
+        """
+        profile = self.pp_state["ext_consumption_forecast"][sb_id]
+        counted = self.forecast_contribution(sb_id, profile, len(self.pp_state["ext_consumption"])) is not None
+
+        for (start, values) in runs:
+            values = np.asarray(values, dtype=float)
+            end = start + len(values)
+            if counted:
+                former = profile[start:end]
+                self.pp_state["ext_consumption"][start:end] += values.clip(min=0) - former.clip(min=0)
+                self.pp_state["ext_generation"][start:end] += (-values).clip(min=0) - (-former).clip(min=0)
+            profile[start:end] = values
+
+    def forecast_update(self, forecast, full=False):
+        """
+        :param forecast: the forecast of this SB to send, from t_0
+        :param full: send the whole forecast instead of the runs that changed
+        :return: the fields of the consumption forecast message: the whole forecast and its version, or the runs that
+        changed since the last version sent ("forecast_data" is then None)
+        """
+        sent = self.pp_state["sent_forecast"]
+        forecast = np.array(forecast, dtype=float)
+        self.pp_state["sent_forecast"] = forecast
+
+        if full or sent is None or len(sent) != len(forecast):
+            self.pp_state["forecast_version"] += 1
+            return {"forecast_data": forecast, "version": self.pp_state["forecast_version"]}
+
+        runs = forecast_runs(sent, forecast)
+        base_version = self.pp_state["forecast_version"]
+        if len(runs) > 0:
+            self.pp_state["forecast_version"] += 1
+
+        return {"forecast_data": None, "runs": runs, "base_version": base_version, "version": self.pp_state["forecast_version"]}
+
+    def check_external_aggregates(self):
+        """
+        Consistency check of the running totals: recompute them from all the stored forecasts
+        """
+        external_consumption, external_generation = self.compute_external_aggregates(len(self.pp_state["ext_consumption"]))
+
+        if not (np.allclose(external_consumption, self.pp_state["ext_consumption"]) and np.allclose(external_generation, self.pp_state["ext_generation"])):
+            logger.warning("SB%s: the running totals of the external forecasts have drifted, they are recomputed", self.id)
+
+        self.pp_state["ext_consumption"], self.pp_state["ext_generation"] = external_consumption, external_generation
+
+    def apply_energy_planning(self, time_data, en_sched, opti_power, solve_info=None):
+        """
+        Store a new schedule of the loads and the corresponding power vector
+        :param time_data: a tuple (t_start, t_end, dt)
+        :param en_sched: a dict load_id -> starting time
+        :param opti_power: the power vector of the loads, from t_start
+        :param solve_info: the status of the solve that produced the schedule, if it was not solved by this object
+        """
+        if solve_info is not None:
+            self.__solve_info = solve_info
 
         self.update_en_sched(en_sched)
         self.update_power_vector(time_data, opti_power)
         logger.debug("The SB has updated its schedule: %s", self.__load_schedule)
 
+    def centralized_planning_request(self, payload_msg):
+        """
+        Centralized planning solved out of this object (see solve_building_planning()): read the price and give the
+        problem to solve
+        :param payload_msg: a START or DATA planning message from the MGM
+        :return: a tuple (building_id, time_data, data_opti, load_schedule)
+        """
+        self.pp_state["electricity_price"] = payload_msg[ZMQ_PLANNING_PAYLOAD_TYPE_PRICE]
+        time_data, data_opti = self.prepare_energy_planning()
+
+        return self.id, time_data, data_opti, dict(self.__load_schedule)
+
+    def centralized_planning_reply(self, time_data, result):
+        """
+        Apply the result of solve_building_planning() and format the answer to the MGM, as run_centralized_planning()
+        :param time_data: the time data of the request
+        :param result: a tuple (load schedule, power vector, solve info)
+        :return: the planning message to send back
+        """
+        en_sched, opti_power, solve_info = result
+        self.apply_energy_planning(time_data, en_sched, opti_power, solve_info)
+
+        return {ZMQ_PLANNING_PAYLOAD_TYPE_SIG_KEY: ZMQ_PLANNING_TYPE_SIG_DATA,
+                ZMQ_PLANNING_PAYLOAD_TYPE_CONS: self.__energy_planning,
+                ZMQ_PLANNING_PAYLOAD_TYPE_SOLVE_INFO: self.__solve_info}
+
+    def solve_schedule(self, scheduler, time_data, data_opti):
+        """
+        Schedule the loads, or take the schedule from the cache if the same problem has already been solved
+        :param scheduler: the load scheduler, with its loads initialized
+        :param time_data: a tuple (t_start, t_end, dt)
+        :param data_opti: the optimization data given to the scheduler
+        :return: a tuple (load schedule, power vector)
+        """
+        key = ScheduleCache.key(time_data, data_opti, scheduler._list_shift_loads)
+        cached = self.__schedule_cache.get(key)
+        if cached is not None:
+            logger.debug("SB%s found its schedule in the cache", self.id)
+            self.__solve_info = {'status': "CACHED", 'gap': None, 'runtime': 0.0, 'objective': None}
+            return dict(cached[0]), list(cached[1])
+
+        en_sched = scheduler.schedule_loads(time_data, data_opti)
+        self.__solve_info = scheduler.solve_info
+
+        if en_sched is None:
+            logger.warning("SB%s has not found any schedule, it keeps its previous one", self.id)
+            en_sched = previous_schedule(scheduler, self.__load_schedule)
+            return en_sched, scheduler.schedule_power_vector(en_sched, time_data)
+
+        opti_power = scheduler.schedule_power_vector(en_sched, time_data)
+        self.__schedule_cache.put(key, dict(en_sched), list(opti_power))
+
+        return en_sched, opti_power
+
+    def create_scheduler(self, time_data):
+        """
+        Create the load scheduler corresponding to the SCHEDULER_MODE and init the loads it has to schedule
+        :param time_data: a tuple (t_start, t_end, dt)
+        :return: the load scheduler
+        """
+        return create_load_scheduler(self.id, time_data, self.__load_schedule)
+
     def update_power_vector(self, time_data, opti_power):
         """
         This method updates the SB power vector after scheduling optimization is done
@@ -549,9 +964,110 @@ class SmartBuildingEntityModel(SmartGridEntityModel):
         for load_id in new_en_sched.keys():
             self.__load_schedule[load_id] = new_en_sched[load_id]
 
+def create_load_scheduler(building_id, time_data, load_schedule):
+    """
+    Create the load scheduler corresponding to the SCHEDULER_MODE and init the loads it has to schedule
+    :param building_id: the ID of the smart-building
+    :param time_data: a tuple (t_start, t_end, dt)
+    :param load_schedule: the current schedule of the loads of the building, a dict load_id -> starting time
+    :return: the load scheduler
+    """
+    config_filename = SmartGridEntityModel.CONFIG_FILENAME
+
+    if SCHEDULER_MODE == SCHEDULER_MODE_EXACT:
+        scheduler = EnumerationLoadScheduler(config_filename, SCHEDULER_EXACT_MAX_COMBINATIONS, SCHEDULER_TIME_LIMIT, SCHEDULER_MIP_GAP, SCHEDULER_THREADS)
+    elif SCHEDULER_MODE == SCHEDULER_MODE_COMPILED:
+        scheduler = CompiledLoadScheduler(config_filename, SCHEDULER_BACKEND, {"pwl_segments": SCHEDULER_PWL_SEGMENTS}, SCHEDULER_TIME_LIMIT, SCHEDULER_MIP_GAP, SCHEDULER_THREADS)
+    else:
+        scheduler = InteractiveLoadScheduler(config_filename, SCHEDULER_TIME_LIMIT, SCHEDULER_MIP_GAP, SCHEDULER_THREADS)
+
+    scheduler.init_loads(building_id, time_data, load_schedule)
+
+    return scheduler
+
+
+def previous_schedule(scheduler, load_schedule):
+    """
+    Fallback when no feasible schedule has been found: the previous starting times of the loads that remain to schedule
+    """
+    return dict((l.id, load_schedule[l.id]) for l in scheduler._list_shift_loads if l.id in load_schedule)
+
+
+def solve_building_planning(request):
+    """
+    Solve the scheduling problem of a smart-building out of its model, e.g. in a worker of a process pool
+    :param request: a tuple (building_id, time_data, data_opti, load_schedule), see centralized_planning_request()
+    :return: a tuple (load schedule, power vector, solve info)
+    """
+    building_id, time_data, data_opti, load_schedule = request
+
+    scheduler = create_load_scheduler(building_id, time_data, load_schedule)
+    en_sched = scheduler.schedule_loads(time_data, data_opti)
+    if en_sched is None:
+        logger.warning("SB%s has not found any schedule, it keeps its previous one", building_id)
+        en_sched = previous_schedule(scheduler, load_schedule)
+
+    return en_sched, scheduler.schedule_power_vector(en_sched, time_data), scheduler.solve_info
+
+
+def forecast_runs(former, forecast):
+    """
+    :param former: a forecast (numpy array)
+    :param forecast: its new version, of the same length
+    :return: the list of the runs [start index, new values] where the forecast changed
+    """
+    changed = np.flatnonzero(former != forecast)
+    if len(changed) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(changed) > 1)
+    starts = changed[np.r_[0, breaks + 1]]
+    ends = changed[np.r_[breaks, len(changed) - 1]] + 1
+
+    return [[int(s), forecast[s:e]] for (s, e) in zip(starts, ends)]
+
+
+def forecast_norm(forecast, norm=None):
+    """
+    :param forecast: a power vector (or a difference of power vectors)
+    :param norm: SIMULATION_CONVERGENCE_NORM_LINF or SIMULATION_CONVERGENCE_NORM_L1, SIMULATION_CONVERGENCE_NORM by default
+    :return: its norm [W]
+    """
+    forecast = np.abs(np.asarray(forecast, dtype=float))
+    if len(forecast) == 0:
+        return 0.0
+
+    if (norm or SIMULATION_CONVERGENCE_NORM) == SIMULATION_CONVERGENCE_NORM_L1:
+        return float(forecast.sum())
+    return float(forecast.max())
+
+
+def within_tolerance(residual, reference, cost_delta=None):
+    """
+    :param residual: the norm of the change of a planning
+    :param reference: the norm of the former planning
+    :param cost_delta: the cost of the new planning minus the cost of the former one, None if unknown
+    :return: True if the change is within the convergence tolerances: small enough, or not decreasing the cost by more
+    than SIMULATION_CONVERGENCE_COST_TOL
+    """
+    if residual <= SIMULATION_CONVERGENCE_ABS_TOL + SIMULATION_CONVERGENCE_REL_TOL * reference:
+        return True
+    return SIMULATION_CONVERGENCE_COST_TOL is not None and cost_delta is not None and cost_delta >= -SIMULATION_CONVERGENCE_COST_TOL
+
+
+def same_forecast(forecast_a, forecast_b):
+    """
+    :return: True if two forecasts (lists, numpy arrays or None) are equal
+    """
+    if forecast_a is None or forecast_b is None:
+        return forecast_a is forecast_b
+    return len(forecast_a) == len(forecast_b) and np.array_equal(forecast_a, forecast_b)
+
+
 def resample_price_sig(price_signal, _type, time_data):
     """
-    TODO: describe
+    Resample a daily price signal at the time step and take the window [t_s, t_e] of the day
+    The resampling is done once per signal and time step by PriceTable: the returned vector is a read-only view
     """
 
     (t_s, t_e, time_step) = time_data
@@ -566,22 +1082,12 @@ def resample_price_sig(price_signal, _type, time_data):
     elif _type == 0:  # price signal as a simple vector
         signal = price_signal
 
-    # Price signal is hourly -> repeat the values
-    ratio_time = int((24*3600/time_step) / len(price_signal))
-    interpolated_signal = np.repeat(signal, ratio_time)
-
-    # Take the right indexes
-    idx_start = int(t_s/time_step)
-    idx_stop = int(t_e/time_step)
-
-    resized_sig = interpolated_signal[idx_start:idx_stop]
-
-    return resized_sig
+    return PriceTable.get(signal, time_step).window(t_s, t_e)
 
 
-def generate_forecast(signal_data, time_data, fault=None):
+def generate_forecast(signal_data, time_data, faults=()):
     """
-    Reframe a signal according to time_data and apply a fault, if specified
+    Reframe a signal according to time_data and apply the active faults, if any
     """
     # Extract time data
     (current_time, t_e, dt) = time_data
@@ -595,9 +1101,9 @@ def generate_forecast(signal_data, time_data, fault=None):
     # select the forecast from t_s to t_e, in term of indexes
     ret = signal_data[idx_st:idx_end]
 
-    # If there is a fault forecast, apply it
-    if fault is not None:
-        ret = fault.apply_fault((t_s, dt, ret))
+    # If there are fault forecasts, apply them
+    if len(faults) > 0:
+        ret = apply_faults(faults, (t_s, dt, ret))
 
     return ret
 
@@ -607,4 +1113,4 @@ if __name__ == '__main__':
 
     test_fault = FaultForecast(12*3600, 18*3600, 0)
     test_forecast = range(0, 96, 1)
-    print generate_forecast(test_forecast, (8*3600, 24*3600, 900), test_fault)
+    print generate_forecast(test_forecast, (8*3600, 24*3600, 900), [test_fault])
@@ -18,11 +18,53 @@ SIMULATION_DT = simu_config["SIMULATION_PARAMETERS"]["TIME_STEP"]  # The simulat
 SIMULATION_STARTING_DATE = simu_config["SIMULATION_PARAMETERS"]["STARTING_DATE"]  # the beginning of simulation
 SIMULATION_DURATION = simu_config["SIMULATION_PARAMETERS"]["DURATION"]  # the simulation duration, in seconds
 SIMULATION_PLANNING_FREQ = simu_config["SIMULATION_PARAMETERS"]["PLANNING_FREQUENCY"]
+SIMULATION_SEED = simu_config["SIMULATION_PARAMETERS"].get("SEED", None)  # seed of the random draws of the entities, None for a random seed
+SIMULATION_FAST_FORWARD = simu_config["SIMULATION_PARAMETERS"].get("FAST_FORWARD", False)  # no waiting: the entities answer as soon as they are ready
+
+SIMULATION_PLANNING_UPDATE_SEQUENTIAL = "SEQUENTIAL"  # the SBs solve one after the other (round-robin)
+SIMULATION_PLANNING_UPDATE_JACOBI = "JACOBI"  # all the SBs solve against the same snapshot, updates applied at the end of the round
+SIMULATION_PLANNING_UPDATE_MODE = simu_config["SIMULATION_PARAMETERS"].get("PLANNING_UPDATE_MODE", SIMULATION_PLANNING_UPDATE_SEQUENTIAL)
+SIMULATION_PLANNING_UPDATE_PROB = simu_config["SIMULATION_PARAMETERS"].get("PLANNING_UPDATE_PROBABILITY", 1.0)  # JACOBI: probability for a SB to apply its new best response
+
+# Convergence of the GT planning: a SB keeps its planning when the new one is within tolerance of it (optional)
+planning_convergence = simu_config["SIMULATION_PARAMETERS"].get("PLANNING_CONVERGENCE", {})
+
+SIMULATION_CONVERGENCE_NORM_LINF = "LINF"  # largest difference of power [W]
+SIMULATION_CONVERGENCE_NORM_L1 = "L1"  # sum of the differences of power [W]
+SIMULATION_CONVERGENCE_NORM = planning_convergence.get("NORM", SIMULATION_CONVERGENCE_NORM_LINF)
+SIMULATION_CONVERGENCE_ABS_TOL = planning_convergence.get("ABS_TOL", 0.0)  # [W], 0 and REL_TOL 0: the planning has to be the same
+SIMULATION_CONVERGENCE_REL_TOL = planning_convergence.get("REL_TOL", 0.0)  # relative to the norm of the current planning
+SIMULATION_CONVERGENCE_COST_TOL = planning_convergence.get("COST_TOL", None)  # also within tolerance if the cost decreases by less than this, None to disable
 
 NB_SB_SIMU = simu_config["SB_CONFIG"]["NB"]  # the total amount of smart-buildings
 NB_DER_SIMU = simu_config["DER_CONFIG"]["NB"]  # the total amount of DERs
 
 SG_ENTITIES_INSTANCES = simu_config["INSTANCES"]  # the type of model to use to instantiate each entity
+SG_ENTITIES_HOSTS = SG_ENTITIES_INSTANCES.get("HOSTS", 0)  # number of processes running the built-in entities, 0 for one process per entity
+
+SG_ENTITIES_RUNTIME_POLL = "POLL"  # the main loop polls the messages of the coordinator and handles them one after the other
+SG_ENTITIES_RUNTIME_EVENT = "EVENT"  # the messages are received while the entities are planning (gevent)
+SG_ENTITIES_RUNTIME = SG_ENTITIES_INSTANCES.get("RUNTIME", SG_ENTITIES_RUNTIME_POLL)
+SG_ENTITIES_QUEUE_SIZE = SG_ENTITIES_INSTANCES.get("QUEUE_SIZE", 64)  # EVENT: messages received and not handled yet, beyond that they wait in ZMQ
+
+# Scheduler config (optional)
+
+scheduler_config = simu_config.get("SCHEDULER_CONFIG", {})
+
+SCHEDULER_MODE_MILP = "MILP"  # gurobipy MILP
+SCHEDULER_MODE_EXACT = "EXACT"  # enumeration of the starting times, MILP above EXACT_MAX_COMBINATIONS combinations
+SCHEDULER_MODE_COMPILED = "COMPILED"  # sparse matrix form of the MILP, solved by BACKEND (GUROBI, HIGHS or CBC)
+
+SCHEDULER_MODE = scheduler_config.get("MODE", SCHEDULER_MODE_MILP)  # the way the smart-buildings schedule their loads
+SCHEDULER_EXACT_MAX_COMBINATIONS = scheduler_config.get("EXACT_MAX_COMBINATIONS", 10**6)
+SCHEDULER_BACKEND = scheduler_config.get("BACKEND", "GUROBI")
+SCHEDULER_PWL_SEGMENTS = scheduler_config.get("PWL_SEGMENTS", 16)  # linearization of the quadratic term for HIGHS and CBC
+SCHEDULER_CACHE_SIZE = scheduler_config.get("CACHE_SIZE", 64)  # schedules memorized by each smart-building, 0 to disable
+SCHEDULER_TIME_LIMIT = scheduler_config.get("TIME_LIMIT", None)  # budget of each solve [s], the best schedule found is used
+SCHEDULER_MIP_GAP = scheduler_config.get("MIP_GAP", None)  # relative optimality gap at which a solve stops
+SCHEDULER_THREADS = scheduler_config.get("THREADS", None)  # threads of each solve, None for the solver default (all the cores)
+SCHEDULER_CENTRALIZED_BATCH = scheduler_config.get("CENTRALIZED_BATCH", False)  # centralized: one process hosts the built-in SBs and solves them in a pool
+SCHEDULER_BATCH_WORKERS = scheduler_config.get("BATCH_WORKERS", None)  # size of this pool, None for cores / THREADS
 
 ###
 # ZemoMQ parameters of PUB-SUB channels
@@ -40,6 +82,7 @@ ZMQ_GROUP_MGM_ID = simu_config["ZMQ_CONFIG"]["GROUP_MGM_ID"]   # The Smart-Build
 SB_FIRST_ID = simu_config["ZMQ_CONFIG"]["SB_FIRST_ID"]  # the ID of the first SB
 DER_FIRST_ID = simu_config["ZMQ_CONFIG"]["DER_FIRST_ID"]  # the ID of the first SB
 MICROGRID_MANAGER_ID = simu_config["ZMQ_CONFIG"]["MICROGRID_MANAGER_ID"]
+ZMQ_WIRE_FORMAT = simu_config["ZMQ_CONFIG"].get("WIRE_FORMAT", "JSON")  # JSON, or SGB1 to offer the binary format
 
 ###
 # Types of message exchanged between the simu-coordinator and the SG entities
@@ -49,6 +92,14 @@ ZMQ_SG_COORD_NEXT_SIMU_STEP = data_param["SG_COORD_SIGNAL"]["SIMU_STEP"]  # Onli
 ZMQ_SG_COORD_PLANNING_SIGNAL = data_param["SG_COORD_SIGNAL"]["PLANNING_SIGNAL"]  # Planning signal
 ZMQ_SG_COORD_STOP = data_param["SG_COORD_SIGNAL"]["STOP"]  # Stopping signal
 ZMQ_SG_COORD_NEW_CONNECTION = data_param["SG_COORD_SIGNAL"]["NEW_CONNECTION"]  # Planning signal
+ZMQ_SG_COORD_NEXT_SIMU_STEP_BATCH = data_param["SG_COORD_SIGNAL"]["SIMU_STEP_BATCH"]  # Online data of several entities of a host process
+
+###
+# Registration: negotiation of the wire format
+###
+
+ZMQ_NEW_CONNECTION_WIRE_FORMATS = data_param["NEW_CONNECTION_PAYLOAD_KEYS"]["WIRE_FORMATS"]  # formats offered by the entity
+ZMQ_NEW_CONNECTION_WIRE_FORMAT = data_param["NEW_CONNECTION_PAYLOAD_KEYS"]["WIRE_FORMAT"]  # format chosen by the coordinator
 
 ###
 # Real-time type of data exchanged
@@ -58,6 +109,7 @@ ZMQ_RT_DATA_PRICE = data_param["NEXT_SIMU_STEP_PAYLOAD_KEYS"]["PRICE_DATA"]  # O
 ZMQ_RT_DATA_CONSUMPTION = data_param["NEXT_SIMU_STEP_PAYLOAD_KEYS"]["CONSUMPTION_DATA"]  # Register to the SG coordinator
 ZMQ_RT_DATA_GENERATION = data_param["NEXT_SIMU_STEP_PAYLOAD_KEYS"]["GENERATION_DATA"]  # Register to the SG coordinator
 ZMQ_RT_DATA_PLANNING_REQUEST = data_param["NEXT_SIMU_STEP_PAYLOAD_KEYS"]["PLANNING_PHASE_REQUEST"]  # offline data sent to the the SG coordinator as day-ahead logic goes on
+ZMQ_RT_DATA_BATCH_ENTRIES = data_param["NEXT_SIMU_STEP_PAYLOAD_KEYS"]["BATCH_ENTRIES"]  # the online data of each entity of a batch: [{"id", "timestamp", "data"}]
 
 
 ###
@@ -76,3 +128,7 @@ ZMQ_PLANNING_PAYLOAD_TYPE_GEN = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["GENE
 ZMQ_PLANNING_PAYLOAD_TYPE_CONS = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["CONSUMPTION_FORECAST"]
 ZMQ_PLANNING_PAYLOAD_TYPE_MODEL = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["MODEL_DATA"]
 ZMQ_PLANNING_PAYLOAD_TYPE_BLOCKCHAIN = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["BLOCKCHAIN_DATA"]
+ZMQ_PLANNING_PAYLOAD_TYPE_SOLVE_INFO = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["SOLVE_INFO"]
+ZMQ_PLANNING_PAYLOAD_TYPE_RESYNC = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["RESYNC"]  # IDs of the SBs whose whole forecast is requested
+ZMQ_PLANNING_PAYLOAD_TYPE_RESIDUAL = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["RESIDUAL"]  # distance between the new and the former planning of a SB
+ZMQ_PLANNING_PAYLOAD_TYPE_COST_DELTA = data_param["PLANNING_SIGNAL_PAYLOAD_KEYS"]["COST_DELTA"]  # cost of the new planning minus the cost of the former one
@@ -0,0 +1,130 @@
+"""
+Wire formats of the messages exchanged between the SG entities and the simulation coordinator
+
+ - JSON: the message as a JSON string (default, and fallback of every connection)
+ - SGB1: "SGB1" | header length (uint32 LE) | header JSON, padded with spaces to a multiple of 8 bytes | body
+   The body holds the float64 LE arrays of the message. In the header, an array is replaced by {"__f64": [offset, n]}
+   (offset in number of floats in the body) and regular timestamps by {"__ts": [t_0, dt, n]}.
+
+The binary format is negotiated per connection: an entity offers the formats it supports in its NEW_CONNECTION message
+and the coordinator acknowledges the one to use. decode() accepts both formats, whatever was negotiated.
+The coordinator side is implemented in app-nodejs/sg_wire.js.
+"""
+
+import json
+import struct
+import numpy as np
+
+WIRE_FORMAT_JSON = "JSON"
+WIRE_FORMAT_BINARY = "SGB1"
+
+MAGIC = b"SGB1"
+ARRAY_KEY = "forecast_data"  # the lists of numbers under this key are sent as float64 arrays
+
+
+class TimeRange(object):
+    """
+    Regular timestamps t_0, t_0 + dt, ... (before t_end), sent as (t_0, dt, n) by the binary format
+    """
+
+    def __init__(self, t_0, t_end, dt):
+        self.t_0 = t_0
+        self.dt = dt
+        self.n = max(int(np.ceil((t_end - t_0) / float(dt))), 0)
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, TimeRange):
+            return (self.t_0, self.dt, self.n) == (other.t_0, other.dt, other.n)
+        return self.tolist() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def tolist(self):
+        return [self.t_0 + k * self.dt for k in range(self.n)]
+
+
+def json_default(obj):
+    """
+    JSON encoding of the objects that the json module does not know
+    """
+    if isinstance(obj, (TimeRange, np.ndarray)):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("{} is not JSON serializable".format(type(obj)))
+
+
+def to_json(msg):
+    return json.dumps(msg, default=json_default)
+
+
+def encode(msg, wire_format=WIRE_FORMAT_BINARY):
+    """
+    :param msg: the message (a dictionary)
+    :param wire_format: WIRE_FORMAT_BINARY or WIRE_FORMAT_JSON
+    :return: the encoded message, as a string
+    """
+    if wire_format != WIRE_FORMAT_BINARY:
+        return to_json(msg)
+
+    arrays = []
+    size = [0]  # number of floats in the body
+
+    def pack(obj, key=None):
+        if isinstance(obj, TimeRange):
+            return {"__ts": [obj.t_0, obj.dt, obj.n]}
+
+        if isinstance(obj, np.ndarray) or (key == ARRAY_KEY and isinstance(obj, (list, tuple))):
+            try:
+                array = np.ascontiguousarray(obj, dtype='<f8')
+            except (TypeError, ValueError):  # not only numbers: stays in the header
+                array = None
+            if array is not None and array.ndim == 1:
+                arrays.append(array)
+                size[0] += len(array)
+                return {"__f64": [size[0] - len(array), len(array)]}
+
+        if isinstance(obj, dict):
+            return dict((k, pack(v, k)) for (k, v) in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return [pack(v) for v in obj]
+        return obj
+
+    header = json.dumps(pack(msg), default=json_default).encode('utf-8')
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+    return b"".join([MAGIC, struct.pack('<I', len(header)), header] + [a.tobytes() for a in arrays])
+
+
+def decode(raw):
+    """
+    :param raw: a message encoded in any of the wire formats
+    :return: the message (a dictionary). Its float64 arrays are read-only views of "raw" and its regular timestamps
+    are TimeRange objects.
+    """
+    if raw[:len(MAGIC)] != MAGIC:
+        return json.loads(raw)
+
+    try:
+        (header_length,) = struct.unpack_from('<I', raw, len(MAGIC))
+    except struct.error:
+        raise ValueError("Truncated SGB1 message")
+    body_start = len(MAGIC) + 4 + header_length
+
+    def unpack(obj):
+        if len(obj) == 1 and "__f64" in obj:
+            (offset, n) = obj["__f64"]
+            return np.frombuffer(raw, dtype='<f8', count=n, offset=body_start + 8 * offset)
+        if len(obj) == 1 and "__ts" in obj:
+            (t_0, dt, n) = obj["__ts"]
+            return TimeRange(t_0, t_0 + n * dt, dt)
+        return obj
+
+    return json.loads(raw[len(MAGIC) + 4:body_start].decode('utf-8'), object_hook=unpack)
@@ -3,12 +3,16 @@ __author__ = 'Olivier Van Cutsem'
 import sys, os, inspect
 import time
 import numpy as np
-from multiprocessing import Process
+from multiprocessing import Process, Pool, cpu_count
 import logging
 
 from sg_entity_param import *
-from sg_entity_model import MicroGridManagerEntityModel, DistributedEnergyResourceEntityModel, SmartBuildingEntityModel
+from sg_entity_model import MicroGridManagerEntityModel, DistributedEnergyResourceEntityModel, SmartBuildingEntityModel, solve_building_planning
+import sg_wire
 import zmq.green as zmq
+import gevent
+from gevent.queue import Queue
+from gevent.threadpool import ThreadPool
 
 # --- Logger INIT
 # Set level of logger (ERROR > INFO > DEBUG)
@@ -17,6 +21,9 @@ cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(insp
 logging.basicConfig(filename=cmd_folder+'/../data/log/sg_entity_processes.log', level=logging.DEBUG)
 logger = logging.getLogger('sgEntityProcess')
 
+# The wire format of the messages sent by each entity, acknowledged by the coordinator (JSON until then)
+wire_formats = {}
+
 # ----------------------------------------------------------------------------- #
 # --------- The generic process that emulates any smart grid entity ----------- #
 # - It is supposed that external coordinator has created the PUB-SUB channels - #
@@ -44,7 +51,8 @@ def sg_entity_process(my_id_txt, instance_class, simu_parameters):
     socket_poller = zmq.Poller()
     socket_poller.register(sg_coord_sub, zmq.POLLIN)
 
-    time.sleep(0.5)  # Wait for socket to have settle, just in case
+    if not SIMULATION_FAST_FORWARD:
+        time.sleep(0.5)  # Wait for socket to have settle, just in case
 
     logger.info("SG entity#{0} has been created ".format(my_id))
 
@@ -57,49 +65,292 @@ def sg_entity_process(my_id_txt, instance_class, simu_parameters):
 
     logger.info("SG entity#{0} enters its main loop -- Ready to work !".format(my_id))
 
+    if SG_ENTITIES_RUNTIME == SG_ENTITIES_RUNTIME_EVENT:
+        run_event_loop(sg_coord_sub, ent_pub, [sg_entity_obj], planning_delay=True)
+        return
+
     while True:
 
         # ---
         # Wait for a signal from the SIMU COORD
         # ---
 
-        type_msg, payload_msg = listen_for_sg_coord_signal(sg_coord_sub, socket_poller)
+        _, type_msg, payload_msg = listen_while_registering(sg_coord_sub, socket_poller, ent_pub, [sg_entity_obj])
 
-        if type_msg == ZMQ_SG_COORD_NEXT_SIMU_STEP:  # Next simu step ?
+        if type_msg == ZMQ_SG_COORD_STOP:  # Stop the process !
+            break
+
+        if type_msg == ZMQ_SG_COORD_PLANNING_SIGNAL and not SIMULATION_FAST_FORWARD:
+            time.sleep(np.random.rand(1)[0])
+
+        process_sg_coord_signal(ent_pub, sg_entity_obj, type_msg, payload_msg)
+
+        if type_msg == ZMQ_SG_COORD_NEXT_SIMU_STEP and not SIMULATION_FAST_FORWARD:
+            time.sleep(0.2)
+
+
+def entity_host_process(list_entities, simu_parameters):
+    """
+    A single process hosts several SG entities of any type, over one PUB-SUB pair. Each entity keeps its own ID in
+    the messages: the coordinator sees them as if they were in their own process
+    :param list_entities: a list of tuples (ID, class that implements the core logic)
+    :param simu_parameters: set of parameters
+    :return: /
+    """
+
+    time_data = (SIMULATION_STARTING_DATE, SIMULATION_DT)  # (init time, time step)
+    ent_objs = [instance_class(ent_id=i, time_data=time_data, simu_param=None) for (i, instance_class) in list_entities]
+
+    # One PUB-SUB pair for all the entities, subscribed to the messages of each of them and of their groups
+    (sg_coord_sub, ent_pub) = connect_pub_sub_sockets(ent_objs[0].id)
+    for ent_obj in ent_objs[1:]:
+        subscribe_sg_entity(sg_coord_sub, ent_obj.id)
+    socket_poller = zmq.Poller()
+    socket_poller.register(sg_coord_sub, zmq.POLLIN)
+
+    if not SIMULATION_FAST_FORWARD:
+        time.sleep(0.5)  # Wait for socket to have settle, just in case
+
+    logger.info("SG entity host of {0} entities has been created: {1}".format(len(ent_objs), [e.id for e in ent_objs]))
+
+    for ent_obj in ent_objs:
+        register_to_coordinator(ent_pub, ent_obj)
+
+    # ----------------- #
+    # --- MAIN LOOP --- #
+    # ----------------- #
 
-            # ---
-            # ONLINE logic
-            # ---
+    if SG_ENTITIES_RUNTIME == SG_ENTITIES_RUNTIME_EVENT:
+        run_event_loop(sg_coord_sub, ent_pub, ent_objs)
+        return
 
-            rt_msg = sg_entity_obj.rt_phase(payload_msg)
-            logger.debug("[@%s] SG entity %s receives a RealTime msg: %s", sg_entity_obj.current_time, my_id, rt_msg)
+    while True:
+
+        receiver, type_msg, payload_msg = listen_while_registering(sg_coord_sub, socket_poller, ent_pub, ent_objs)
 
-            # --- Send it to the Coordinator
-            send_sg_coord_rt_data(ent_pub, sg_entity_obj, rt_msg)
+        if type_msg == ZMQ_SG_COORD_STOP:  # Stop the process !
+            break
 
-            # --- UPDATE SIMULATION TIME
-            sg_entity_obj.update_time()
+        process_sg_coord_signals(ent_pub, message_targets(receiver, ent_objs), type_msg, payload_msg)
 
+        if type_msg == ZMQ_SG_COORD_NEXT_SIMU_STEP and not SIMULATION_FAST_FORWARD:
             time.sleep(0.2)
 
+
+def run_event_loop(sg_coord_sub, ent_pub, ent_objs, planning_delay=False):
+    """
+    Event-driven main loop of a process running one or several entities, instead of the polling one:
+     - a greenlet receives the messages of the coordinator as soon as they arrive and queues them. The queue is bounded:
+       when it is full, the greenlet stops reading and the messages wait in the ZMQ buffers
+     - another greenlet handles them in order. The planning, CPU-bound, runs in a thread so that the messages keep on
+       being received: a STOP ends the process without waiting for the end of the current solve
+    Only the greenlets of the main thread use the sockets.
+    :param sg_coord_sub: the SUB socket, subscribed to the messages of the entities
+    :param ent_pub: the PUB socket to the coordinator
+    :param ent_objs: the entity objects of the process
+    :param planning_delay: wait a random delay before handling a planning message, as sg_entity_process()
+    :return: /
+    """
+    queue = Queue(maxsize=SG_ENTITIES_QUEUE_SIZE)
+    solver_thread = ThreadPool(1)
+
+    def run_in_thread(function, *args):
+        return solver_thread.apply(function, args)
+
+    def receive():
+        while True:
+            (receiver, msg_raw) = sg_coord_sub.recv_multipart()
+            try:
+                msg = sg_wire.decode(msg_raw)
+            except ValueError:
+                logger.warning("Message to %s that cannot be decoded, it is ignored", receiver)
+                continue
+
+            if msg["TYPE"] == ZMQ_SG_COORD_STOP:
+                return
+            queue.put((receiver, msg["TYPE"], msg["DATA"]))  # waits while the queue is full
+
+    def handle():
+        while True:
+            receiver, type_msg, payload_msg = queue.get()
+
+            if type_msg == ZMQ_SG_COORD_PLANNING_SIGNAL and planning_delay and not SIMULATION_FAST_FORWARD:
+                gevent.sleep(np.random.rand(1)[0])
+
+            process_sg_coord_signals(ent_pub, message_targets(receiver, ent_objs), type_msg, payload_msg, run_in_thread)
+
+            if type_msg == ZMQ_SG_COORD_NEXT_SIMU_STEP and not SIMULATION_FAST_FORWARD:
+                gevent.sleep(0.2)
+
+    def register():
+        # Fast-forward: register again the entities whose registration is not acknowledged (see listen_while_registering())
+        while SIMULATION_FAST_FORWARD:
+            gevent.sleep(0.1)
+            pending = [ent_obj for ent_obj in ent_objs if ent_obj.id not in wire_formats]
+            if len(pending) == 0:
+                return
+            for ent_obj in pending:
+                register_to_coordinator(ent_pub, ent_obj)
+
+    greenlets = [gevent.spawn(receive), gevent.spawn(handle), gevent.spawn(register)]
+
+    # Until the STOP, or an error while receiving or in the logic of an entity
+    gevent.wait(greenlets[:2], count=1)
+    gevent.killall(greenlets)  # the solve in progress, if any, is not waited for
+
+    for greenlet in greenlets:
+        if greenlet.exception is not None:
+            raise greenlet.exception
+
+
+def process_sg_coord_signals(ent_pub, ent_objs, type_msg, payload_msg, run=None):
+    """
+    process_sg_coord_signal() for several entities of the process. Their answers to a real-time step are sent in a
+    single batch message
+    :param ent_objs: the entity objects the message is for
+    :return: /
+    """
+    if type_msg != ZMQ_SG_COORD_NEXT_SIMU_STEP or len(ent_objs) < 2:
+        for ent_obj in ent_objs:
+            process_sg_coord_signal(ent_pub, ent_obj, type_msg, payload_msg, run)
+        return
+
+    rt_batch = []
+    for ent_obj in ent_objs:
+        rt_msg = ent_obj.rt_phase(payload_msg)
+        logger.debug("[@%s] SG entity %s receives a RealTime msg: %s", ent_obj.current_time, ent_obj.id, rt_msg)
+
+        rt_batch.append({"id": ent_obj.id, "timestamp": ent_obj.timestamp, "data": rt_msg})
+        ent_obj.update_time()
+
+    send_sg_coord_rt_batch(ent_pub, ent_objs[0], rt_batch)
+
+
+def process_sg_coord_signal(ent_pub, ent_obj, type_msg, payload_msg, run=None):
+    """
+    Run the logic of an entity for a message of the coordinator, and send its answer
+    :param ent_pub: the PUB socket to the coordinator
+    :param ent_obj: the entity object
+    :param type_msg: the type of message (anything else than STOP)
+    :param payload_msg: the core of the message
+    :param run: run(function, *args) calls the planning logic, directly by default
+    :return: /
+    """
+    if run is None:
+        run = lambda function, *args: function(*args)
+
+    if type_msg == ZMQ_SG_COORD_NEXT_SIMU_STEP:  # Next simu step ?
+
+        # ---
+        # ONLINE logic
+        # ---
+
+        rt_msg = ent_obj.rt_phase(payload_msg)
+        logger.debug("[@%s] SG entity %s receives a RealTime msg: %s", ent_obj.current_time, ent_obj.id, rt_msg)
+
+        # --- Send it to the Coordinator
+        send_sg_coord_rt_data(ent_pub, ent_obj, rt_msg)
+
+        # --- UPDATE SIMULATION TIME
+        ent_obj.update_time()
+
+    elif type_msg == ZMQ_SG_COORD_PLANNING_SIGNAL:  # Planning phase message
+
+        # ---
+        # PLANNING logic
+        # ---
+
+        planning_msg = run(ent_obj.planning_phase, payload_msg)
+        logger.debug("[@%s] SG entity %s receives a Planning msg: %s", ent_obj.current_time, ent_obj.id, planning_msg)
+
+        # --- Send it to the Coordinator
+        # Exeception: In Planning mode, we could for example receive data without sending back an answer
+        if planning_msg != None:
+            send_sg_coord_planning_data(ent_pub, ent_obj, planning_msg)
+
+    elif type_msg == ZMQ_SG_COORD_NEW_CONNECTION:  # Registration acknowledged
+        set_wire_format(ent_pub, ent_obj, payload_msg)
+
+
+def sb_batch_process(list_ids, instance_class, simu_parameters):
+    """
+    Centralized architecture only: a single process hosts several Smart-Buildings. Their planning problems do not
+    depend on each other: they are all solved at once by a pool of workers, and each SB answers as it would alone
+    :param list_ids: the IDs of the Smart-Buildings
+    :param instance_class: the class that implements the core logic of a SB
+    :param simu_parameters: set of parameters
+    :return: /
+    """
+
+    # The workers are forked before any socket is opened
+    nb_workers = SCHEDULER_BATCH_WORKERS
+    if nb_workers is None:
+        nb_workers = max(cpu_count() / max(SCHEDULER_THREADS or 1, 1), 1)
+    solver_pool = Pool(nb_workers)
+
+    time_data = (SIMULATION_STARTING_DATE, SIMULATION_DT)  # (init time, time step)
+    sb_objs = [instance_class(ent_id=i, time_data=time_data, simu_param=None) for i in list_ids]
+
+    # One PUB-SUB pair for all the SBs, subscribed to the messages of each of them
+    (sg_coord_sub, ent_pub) = connect_pub_sub_sockets(list_ids[0])
+    for i in list_ids[1:]:
+        sg_coord_sub.setsockopt(zmq.SUBSCRIBE, str(i) + "e")
+    socket_poller = zmq.Poller()
+    socket_poller.register(sg_coord_sub, zmq.POLLIN)
+
+    if not SIMULATION_FAST_FORWARD:
+        time.sleep(0.5)  # Wait for socket to have settle, just in case
+
+    logger.info("SB batch of {0} buildings has been created, with {1} solving workers".format(len(sb_objs), nb_workers))
+
+    for sb_obj in sb_objs:
+        register_to_coordinator(ent_pub, sb_obj)
+
+    # ----------------- #
+    # --- MAIN LOOP --- #
+    # ----------------- #
+
+    while True:
+
+        receiver, type_msg, payload_msg = listen_while_registering(sg_coord_sub, socket_poller, ent_pub, sb_objs)
+
+        # The SBs concerned by this message
+        targets = [sb_obj for sb_obj in sb_objs if receiver == str(sb_obj.id) + "e"] or sb_objs
+
+        if type_msg == ZMQ_SG_COORD_NEXT_SIMU_STEP:  # Next simu step ?
+
+            process_sg_coord_signals(ent_pub, targets, type_msg, payload_msg)
+
+            if not SIMULATION_FAST_FORWARD:
+                time.sleep(0.2)
+
         elif type_msg == ZMQ_SG_COORD_PLANNING_SIGNAL:  # Planning phase message
 
-            # ---
-            # PLANNING logic
-            # ---
+            type_planning = payload_msg[ZMQ_PLANNING_PAYLOAD_TYPE_SIG_KEY]
 
-            time.sleep(np.random.rand(1)[0])
-            planning_msg = sg_entity_obj.planning_phase(payload_msg)
-            logger.debug("[@%s] SG entity %s receives a Planning msg: %s", sg_entity_obj.current_time, my_id, planning_msg)
+            if type_planning == ZMQ_PLANNING_TYPE_SIG_START or type_planning == ZMQ_PLANNING_TYPE_SIG_DATA:
+                # Solve all the SBs problems in the pool
+                requests = [sb_obj.centralized_planning_request(payload_msg) for sb_obj in targets]
+                results = solver_pool.map(solve_building_planning, requests)
+                planning_msgs = [sb_obj.centralized_planning_reply(req[1], res) for (sb_obj, req, res) in zip(targets, requests, results)]
+            else:
+                planning_msgs = [sb_obj.planning_phase(payload_msg) for sb_obj in targets]
+
+            for (sb_obj, planning_msg) in zip(targets, planning_msgs):
+                logger.debug("[@%s] SG entity %s receives a Planning msg: %s", sb_obj.current_time, sb_obj.id, planning_msg)
+                if planning_msg != None:
+                    send_sg_coord_planning_data(ent_pub, sb_obj, planning_msg)
 
-            # --- Send it to the Coordinator
-            # Exeception: In Planning mode, we could for example receive data without sending back an answer
-            if planning_msg != None:
-                send_sg_coord_planning_data(ent_pub, sg_entity_obj, planning_msg)
+        elif type_msg == ZMQ_SG_COORD_NEW_CONNECTION:  # Registration acknowledged
+            for sb_obj in targets:
+                set_wire_format(ent_pub, sb_obj, payload_msg)
 
         elif type_msg == ZMQ_SG_COORD_STOP:  # Stop the process !
             break
 
+    solver_pool.close()
+    solver_pool.join()
+
 
 def getTypeOfClassFromID(ent_id):
     if ent_id == MICROGRID_MANAGER_ID:
@@ -127,8 +378,20 @@ def connect_pub_sub_sockets(sg_entity_id):
 
     server_sub = zmq_context.socket(zmq.SUB)
     server_sub.connect('tcp://' + ZMQ_SIMU_IP + ':' + ZMQ_SG_COORD_PUB)
+    server_sub.setsockopt(zmq.SUBSCRIBE, str(ZMQ_BROADCAST_ID))  # Listen to the broadcast messages
+    subscribe_sg_entity(server_sub, sg_entity_id)
+
+    return server_sub, sb_pub
+
+
+def subscribe_sg_entity(server_sub, sg_entity_id):
+    """
+    Subscribe a SUB socket to the messages of an entity and of its group
+    :param server_sub: the SUB socket
+    :param sg_entity_id: the ID of the entity
+    :return: /
+    """
     server_sub.setsockopt(zmq.SUBSCRIBE, str(sg_entity_id) + "e")  # Listen only to my messages (suffix e to prevent
-    server_sub.setsockopt(zmq.SUBSCRIBE, str(ZMQ_BROADCAST_ID))  # and broadcast ones
 
     if getTypeOfClassFromID(sg_entity_id) == "mgm":
         server_sub.setsockopt(zmq.SUBSCRIBE, str(ZMQ_GROUP_MGM_ID))  # and group ones
@@ -137,15 +400,30 @@ def connect_pub_sub_sockets(sg_entity_id):
     elif getTypeOfClassFromID(sg_entity_id) == "sb":
         server_sub.setsockopt(zmq.SUBSCRIBE, str(ZMQ_GROUP_SB_ID))  # and broadcast ones
 
-    return server_sub, sb_pub
 
+def message_targets(receiver, ent_objs):
+    """
+    :param receiver: the receiver of a message of the coordinator: "<ID>e", a group ID or the broadcast ID
+    :param ent_objs: the entity objects of the process
+    :return: the entity objects the message is for
+    """
+    if receiver == str(ZMQ_BROADCAST_ID):
+        return ent_objs
+
+    groups = {str(ZMQ_GROUP_MGM_ID): "mgm", str(ZMQ_GROUP_DER_ID): "der", str(ZMQ_GROUP_SB_ID): "sb"}
+    if receiver in groups:
+        return [e for e in ent_objs if getTypeOfClassFromID(e.id) == groups[receiver]]
+
+    return [e for e in ent_objs if receiver == str(e.id) + "e"]
 
-def listen_for_sg_coord_signal(sg_coord_sub, socket_poller, max_attempt=100):
+
+def listen_for_sg_coord_signal(sg_coord_sub, socket_poller, max_attempt=100, with_receiver=False):
     """
     TODO
     :param sg_coord_sub:
     :param socket_poller:
     :param max_attempt: set it to 0 for a non-blocking listen
+    :param with_receiver: if True, the receiver of the message (ID, group or broadcast) is returned first
     :return: a tuple:
      - A string representing the type of message
      - A dictionary, representing the core of the message
@@ -160,19 +438,23 @@ def listen_for_sg_coord_signal(sg_coord_sub, socket_poller, max_attempt=100):
         if socks.get(sg_coord_sub) == zmq.POLLIN:
             m = sg_coord_sub.recv_multipart()
 
-            (rec, msg_raw) = m  # rec = receiver, msg_raw = message as a dictionary
+            (rec, msg_raw) = m  # rec = receiver, msg_raw = message as a dictionary, in any wire format
             try:
-                msg = json.loads(msg_raw)
+                msg = sg_wire.decode(msg_raw)
 
+                if with_receiver:
+                    return rec, msg["TYPE"], msg["DATA"]
                 return msg["TYPE"], msg["DATA"]
             except ValueError:
-                return None, None
+                break
         else:
             attempt += 1
 
         if attempt >= max_attempt:
             break
 
+    if with_receiver:
+        return None, None, None
     return None, None
 
 
@@ -186,8 +468,54 @@ def register_to_coordinator(ent_pub, ent_obj):
     :return: /
     """
 
+    # The wire formats I can read and write, by order of preference
+    offered_formats = [sg_wire.WIRE_FORMAT_JSON]
+    if ZMQ_WIRE_FORMAT == sg_wire.WIRE_FORMAT_BINARY:
+        offered_formats.insert(0, sg_wire.WIRE_FORMAT_BINARY)
+
     # Publish to the SUB of the nodeJS server
-    send_zmq_message(ent_pub, ZMQ_SG_COORD_NEW_CONNECTION, ent_obj, {})
+    send_zmq_message(ent_pub, ZMQ_SG_COORD_NEW_CONNECTION, ent_obj, {ZMQ_NEW_CONNECTION_WIRE_FORMATS: offered_formats})
+
+
+def set_wire_format(ent_pub, ent_obj, payload_msg):
+    """
+    Store the wire format acknowledged by the coordinator for the messages sent by an entity. In fast-forward mode,
+    the entity confirms that it has received the acknowledgement: the coordinator counts it as connected only then
+    :param ent_pub: the SG-coordinator PUB socket to send a msg to
+    :param ent_obj: the entity object
+    :param payload_msg: the acknowledgement of the coordinator
+    :return: /
+    """
+    wire_format = payload_msg.get(ZMQ_NEW_CONNECTION_WIRE_FORMAT, sg_wire.WIRE_FORMAT_JSON)
+    wire_formats[ent_obj.id] = wire_format
+    logger.info("SG entity#{0} sends its messages in the {1} wire format".format(ent_obj.id, wire_format))
+
+    if SIMULATION_FAST_FORWARD:
+        send_zmq_message(ent_pub, ZMQ_SG_COORD_NEW_CONNECTION, ent_obj, {ZMQ_NEW_CONNECTION_WIRE_FORMAT: wire_format})
+
+
+def listen_while_registering(sg_coord_sub, socket_poller, ent_pub, ent_objs):
+    """
+    listen_for_sg_coord_signal(..., with_receiver=True). In fast-forward mode, the sockets are not given time to
+    settle: the entities whose registration has not been acknowledged yet register again every 100 ms, as their first
+    messages may have been lost
+    :param ent_objs: the entity objects of the process
+    :return: a tuple (receiver, type of message, core of the message)
+    """
+    while True:
+        pending = []
+        if SIMULATION_FAST_FORWARD:
+            pending = [ent_obj for ent_obj in ent_objs if ent_obj.id not in wire_formats]
+
+        if len(pending) == 0:
+            return listen_for_sg_coord_signal(sg_coord_sub, socket_poller, with_receiver=True)
+
+        receiver, type_msg, payload_msg = listen_for_sg_coord_signal(sg_coord_sub, socket_poller, max_attempt=1, with_receiver=True)
+        if type_msg is not None:
+            return receiver, type_msg, payload_msg
+
+        for ent_obj in pending:
+            register_to_coordinator(ent_pub, ent_obj)
 
 
 #  --------- Messages to the coordinator
@@ -202,6 +530,18 @@ def send_sg_coord_rt_data(ent_pub, ent_obj, rt_data):
     send_zmq_message(ent_pub, ZMQ_SG_COORD_NEXT_SIMU_STEP, ent_obj, rt_data)
 
 
+def send_sg_coord_rt_batch(ent_pub, ent_obj, rt_batch):
+    """
+    Send the RT data of several entities to the Simulation Coordinator, in one message
+    :param ent_obj: the entity object that sends the message, one of the batch
+    :param rt_batch: a list of {"id", "timestamp", "data"}, one per entity
+    :return: /
+    """
+
+    # Publish to the SUB of the nodeJS server
+    send_zmq_message(ent_pub, ZMQ_SG_COORD_NEXT_SIMU_STEP_BATCH, ent_obj, {ZMQ_RT_DATA_BATCH_ENTRIES: rt_batch})
+
+
 def send_sg_coord_planning_data(ent_pub, ent_obj, plan_data):
     """
     Send Planning data to the Simulation Coordinator
@@ -223,8 +563,10 @@ def send_zmq_message(ent_pub, msg_type, ent_obj, msg):
     """
     msg_formatted = {"data": msg, "timestamp": ent_obj.timestamp}
 
+    wire_format = wire_formats.get(ent_obj.id, sg_wire.WIRE_FORMAT_JSON)
+
     logger.debug("[@%s] SG entity %s sends a msg to the SG coordinator: %s", ent_obj.timestamp, ent_obj.id, msg)
-    ent_pub.send_multipart([str(msg_type), str("i{}".format(ent_obj.id)), json.dumps(msg_formatted)])
+    ent_pub.send_multipart([str(msg_type), str("i{}".format(ent_obj.id)), sg_wire.encode(msg_formatted, wire_format)])
 
 # --------------------------- #
 # --- Processes launching --- #
@@ -248,29 +590,40 @@ if __name__ == '__main__':
     builtin_entities = SG_ENTITIES_INSTANCES["BUILT_IN"]
     list_sb_builtin = range(SB_FIRST_ID, SB_FIRST_ID+builtin_entities["SB"])
 
-    # --- BUILT-IN entities
+    # --- BUILT-IN entities: a list of (ID, class)
+    builtin_list = []
 
     # - DERs
     for i in range(DER_FIRST_ID, DER_FIRST_ID+NB_DER_SIMU):
-        der_class = DistributedEnergyResourceEntityModel
-        der = Process(target=sg_entity_process, args=("id{}".format(i), der_class, None))
-        der.start()
-        entity_list.append(der)
+        builtin_list.append((i, DistributedEnergyResourceEntityModel))
 
     # - MGM
     if SIMULATION_ARCH_CENTRALIZED:
-        for i in [MICROGRID_MANAGER_ID]:
-            mgm_class = MicroGridManagerEntityModel
-            mgm = Process(target=sg_entity_process, args=("id{}".format(i), mgm_class, None))
-            mgm.start()
-            entity_list.append(mgm)
+        builtin_list.append((MICROGRID_MANAGER_ID, MicroGridManagerEntityModel))
 
     # - Smart-Buildings
-    for i in list_sb_builtin:
-        sb_class = SmartBuildingEntityModel
-        sb = Process(target=sg_entity_process, args=("id{}".format(i), sb_class, None))
-        sb.start()
-        entity_list.append(sb)
+    sb_batch_mode = SIMULATION_ARCH_CENTRALIZED and SCHEDULER_CENTRALIZED_BATCH and len(list_sb_builtin) > 0
+    if not sb_batch_mode:
+        builtin_list += [(i, SmartBuildingEntityModel) for i in list_sb_builtin]
+
+    if SG_ENTITIES_HOSTS > 0 and len(builtin_list) > 0:
+        # The entities are spread over the hosts, each of them running several entities
+        nb_hosts = min(SG_ENTITIES_HOSTS, len(builtin_list))
+        for k in range(nb_hosts):
+            host = Process(target=entity_host_process, args=(builtin_list[k::nb_hosts], None))
+            host.start()
+            entity_list.append(host)
+    else:
+        for (i, ent_class) in builtin_list:
+            ent = Process(target=sg_entity_process, args=("id{}".format(i), ent_class, None))
+            ent.start()
+            entity_list.append(ent)
+
+    if sb_batch_mode:
+        # All the built-in SBs in one process, that solves their plannings in a pool
+        sb_batch = Process(target=sb_batch_process, args=(list_sb_builtin, SmartBuildingEntityModel, None))
+        sb_batch.start()
+        entity_list.append(sb_batch)
 
     # --- External entities
     list_external_entities = SG_ENTITIES_INSTANCES["EXTERNAL"]
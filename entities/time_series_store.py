@@ -0,0 +1,176 @@
+"""
+Time series of the simulation (DER production, energy prices) stored as memory-mapped binary arrays
+
+A source (a CSV file whose first column holds the dates, or a JSON file of daily vectors) is converted once into one
+.npy file per column and a small JSON index (start time, sampling period, mtime of the source) in STORE_FOLDER. The
+conversion is done again only when the source is modified. The arrays are opened with mmap_mode='r': the entity processes share the
+pages of the OS cache instead of each holding its own copy, and a series can cover a whole year at any resolution.
+"""
+
+import os, inspect
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
+logger = logging.getLogger('sgEntityProcess.model.timeSeriesStore')
+
+DAY_DURATION = 24*3600
+
+
+class TimeSeries(object):
+    """
+    A signal sampled with a constant period from t_0, indexed by the absolute simulation time. A series covering whole
+    days repeats itself after its last day (a one-day profile is the same every day); the samples beyond the last whole
+    day are ignored.
+    """
+
+    def __init__(self, values, t_0, period):
+        """
+        :param values: the (read-only) vector of samples
+        :param t_0: the time [s] of the first sample
+        :param period: the sampling period [s]
+        """
+        self.values = values
+        self.t_0 = t_0
+        self.period = period
+
+        self.length = len(values)
+        nb_days = int(self.length * period // DAY_DURATION)
+        if nb_days > 0 and DAY_DURATION % period == 0:
+            self.length = int(nb_days * DAY_DURATION // period)
+
+    def index(self, t):
+        """
+        :return: the index of the sample covering the time t
+        """
+        return int((t - self.t_0) // self.period) % self.length
+
+    def value_at(self, t):
+        """
+        :return: the value of the signal at the time t
+        """
+        return self.values[self.index(t)]
+
+    def window(self, t_s, t_e, dt=None):
+        """
+        :param t_s: the first time [s] of the window
+        :param t_e: the end [s] of the window
+        :param dt: the time step [s] of the window, the sampling period by default
+        :return: the values of the signal at t_s, t_s + dt, ... until t_e. When the window does not wrap around the end
+        of the series and dt is a multiple of the sampling period, it is a view of the stored array (no copy).
+        """
+        if dt is None:
+            dt = self.period
+        nb_steps = max(int(np.ceil((t_e - t_s) / float(dt))), 0)
+
+        stride = dt / float(self.period)
+        i_0 = self.index(t_s)
+        if stride == int(stride) and (t_s - self.t_0) % self.period == 0:
+            stride = int(stride)
+            i_end = i_0 + (nb_steps - 1) * stride + 1
+            if i_end <= self.length:
+                return self.values[i_0:i_end:stride]
+
+        times = t_s + dt * np.arange(nb_steps)
+        return self.values.take(((times - self.t_0) // self.period).astype(int) % self.length)
+
+
+class TimeSeriesStore(object):
+
+    STORE_FOLDER = "../data/time_series/"  # relative to the entities folder
+
+    _series = {}  # (source path, column) -> (mtime of the source, TimeSeries), opened by this process
+
+    @classmethod
+    def get(cls, source, column):
+        """
+        :param source: the path of the CSV or JSON source
+        :param column: the column of the CSV file, or the key of the JSON file
+        :return: the TimeSeries of this column, converted only if the source changed since the last conversion
+        """
+        path = os.path.realpath(source)
+        mtime = os.path.getmtime(path)
+
+        cached = cls._series.get((path, column))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        folder = cls.folder()
+        entry = cls.index(path, mtime)["columns"][column]
+        series = TimeSeries(np.load(os.path.join(folder, entry["file"]), mmap_mode='r'), entry["t_0"], entry["period"])
+        cls._series[(path, column)] = (mtime, series)
+
+        return series
+
+    @classmethod
+    def folder(cls):
+        folder = os.path.join(cmd_folder, cls.STORE_FOLDER)
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass  # already created
+        return folder
+
+    @classmethod
+    def index(cls, path, mtime):
+        """
+        :return: the index of the source: {"source", "mtime", "columns": {column: {"file", "t_0", "period"}}}
+        """
+        name = "{}_{}".format(os.path.splitext(os.path.basename(path))[0], hashlib.sha1(path.encode('utf-8')).hexdigest()[:8])
+        index_path = os.path.join(cls.folder(), name + ".json")
+
+        if os.path.exists(index_path):
+            index = json.load(open(index_path))
+            if index["mtime"] == mtime:
+                return index
+
+        index = {"source": path, "mtime": mtime, "columns": {}}
+        for (column, (values, t_0, period)) in cls.read_source(path).items():
+            filename = "{}.{}.npy".format(name, column)
+            cls.write_atomic(os.path.join(cls.folder(), filename), lambda f, v=values: np.save(f, v))
+            index["columns"][column] = {"file": filename, "t_0": t_0, "period": period}
+
+        cls.write_atomic(index_path, lambda f: f.write(json.dumps(index).encode('utf-8')))
+        logger.info("Time series store: {} converted ({} columns)".format(path, len(index["columns"])))
+
+        return index
+
+    @staticmethod
+    def read_source(path):
+        """
+        :return: a dict column -> (vector of float64, time of the first sample [s], sampling period [s])
+        """
+        ret = {}
+
+        if path.endswith(".json"):
+            # Daily vectors: the samples are spread evenly on the day
+            for (key, values) in json.load(open(path)).items():
+                if isinstance(values, list) and len(values) > 0 and all(isinstance(v, (int, float)) for v in values):
+                    ret[key] = (np.asarray(values, dtype=np.float64), 0, DAY_DURATION / float(len(values)))
+            return ret
+
+        df = pd.read_csv(path)
+        t_0, period = 0, None
+        if df[df.columns[0]].dtype == object:  # the first column holds the dates of the samples
+            dates = pd.to_datetime(df.pop(df.columns[0]))
+            t_0 = int((dates[0] - dates[0].normalize()).total_seconds())  # the first day begins at t=0
+            if len(dates) > 1:
+                period = int((dates[1] - dates[0]).total_seconds())
+
+        for column in df.select_dtypes(include=[np.number]).columns:
+            ret[column] = (df[column].values.astype(np.float64), t_0, period or DAY_DURATION / float(len(df)))
+
+        return ret
+
+    @staticmethod
+    def write_atomic(path, write):
+        """
+        Write a file of the store through a temporary file, so that another process never opens a partial file
+        """
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.rename(tmp_path, path)